@@ -0,0 +1,443 @@
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+from app import functions_for_BD, idempotency
+from app.models import Product, Order, OrderStatus
+from app.schemas import ProductInOrderRequest, ProductRequest, ProductResponse, OrderDetailResponse, OrderFilter
+from app.cache import product_cache
+
+#Асинхронные версии функций из functions_for_BD.
+#Каждая функция выполняет синхронную реализацию через AsyncSession.run_sync:
+#запросы идут через асинхронный драйвер, поэтому ожидание БД не блокирует цикл событий,
+#а логика работы с данными остается в одном месте.
+
+async def create_new_product(session: AsyncSession, name_product: str, description_product: str, price_product: float, quantity: int) -> int:
+    """
+    Асинхронное создание товара в таблице Product
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param name_product: Название продукта.
+    :param description_product: Описание продукта.
+    :param price_product: Цена продукта.
+    :param quantity: Количество товара на складе.
+    :return: ID созданного продукта или -1 в случае ошибки.
+    """
+    return await session.run_sync(functions_for_BD.create_new_product, name_product, description_product, price_product, quantity)
+
+
+async def create_products_bulk(session: AsyncSession, products: List[ProductRequest], batch_size: int) -> tuple[List[int], Optional[str]]:
+    """
+    Асинхронное массовое создание товаров пачками по batch_size строк.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param products: Список товаров для создания.
+    :param batch_size: Количество товаров в одной пачке.
+    :return: Список ID созданных товаров и текст ошибки или None.
+    """
+    return await session.run_sync(functions_for_BD.create_products_bulk, products, batch_size)
+
+
+async def create_new_order(session: AsyncSession, date_order: datetime, status: OrderStatus, products: List[ProductInOrderRequest]) -> tuple[str, int, Optional[int]]:
+    """
+    Асинхронное создание нового заказа в таблице Order.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param date_order: Дата заказа
+    :param status: Статус заказа
+    :param products: Список товаров для добавления в заказ
+    :return: ID созданного заказа с сообщением Succes или код ошибки и сообщение об ошибке.
+    """
+    return await session.run_sync(functions_for_BD.create_new_order, date_order, status, products)
+
+
+async def create_orders_batch(session: AsyncSession, orders: List[tuple[datetime, OrderStatus, List[ProductInOrderRequest]]]) -> List[tuple[str, int, Optional[int]]]:
+    """
+    Асинхронное создание пачки заказов в одной транзакции.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param orders: Список заказов (дата, статус, товары) в порядке поступления.
+    :return: Для каждого заказа результат как у create_new_order.
+    """
+    return await session.run_sync(functions_for_BD.create_orders_batch, orders)
+
+
+async def get_products(session: AsyncSession) -> List[Product]:
+    """
+    Асинхронное получение всех продуктов из базы данных.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :return: Список объектов Product.
+    """
+    return await session.run_sync(functions_for_BD.get_products)
+
+
+async def get_orders(session: AsyncSession, filters: Optional[OrderFilter] = None) -> List[Order]:
+    """
+    Асинхронное получение всех заказов из базы данных.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Список объектов Order.
+    """
+    return await session.run_sync(functions_for_BD.get_orders, filters)
+
+
+async def get_product_rows(session: AsyncSession, limit: Optional[int] = None, after: Optional[int] = None) -> List[Row]:
+    """
+    Асинхронное получение продуктов кортежами колонок с пагинацией по ключу (keyset по id).
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param limit: Максимальное количество продуктов. None для всех продуктов.
+    :param after: ID последнего продукта предыдущей страницы. None для первой страницы.
+    :return: Список строк, отсортированный по id.
+    """
+    return await session.run_sync(functions_for_BD.get_product_rows, limit, after)
+
+
+async def get_order_rows(session: AsyncSession, limit: Optional[int] = None, after: Optional[int] = None, filters: Optional[OrderFilter] = None) -> List[Row]:
+    """
+    Асинхронное получение заказов кортежами колонок с пагинацией по ключу (keyset по id).
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param limit: Максимальное количество заказов. None для всех заказов.
+    :param after: ID последнего заказа предыдущей страницы. None для первой страницы.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Список строк, отсортированный по id.
+    """
+    return await session.run_sync(functions_for_BD.get_order_rows, limit, after, filters)
+
+
+async def get_products_version(session: AsyncSession, limit: Optional[int] = None, after: Optional[int] = None) -> Row:
+    """
+    Асинхронное получение версии списка или страницы продуктов для ETag.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param limit: Размер страницы. None для всех продуктов.
+    :param after: ID последнего продукта предыдущей страницы. None для чтения с начала таблицы.
+    :return: Строка (count, max_id, max_updated_at, sum_version, shards_version).
+    """
+    return await session.run_sync(functions_for_BD.get_products_version, limit, after)
+
+
+async def get_orders_version(session: AsyncSession, filters: Optional[OrderFilter] = None, limit: Optional[int] = None, after: Optional[int] = None) -> Row:
+    """
+    Асинхронное получение версии списка или страницы заказов для ETag с учетом условий отбора.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :param limit: Размер страницы. None для всех заказов.
+    :param after: ID последнего заказа предыдущей страницы. None для чтения с начала таблицы.
+    :return: Строка (count, max_id, max_updated_at, sum_version).
+    """
+    return await session.run_sync(functions_for_BD.get_orders_version, filters, limit, after)
+
+
+async def get_product_version(session: AsyncSession, id_product: int) -> Optional[int]:
+    """
+    Асинхронное получение версии продукта для ETag и If-Match.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_product: ID продукта.
+    :return: Номер версии продукта или None, если продукт не найден.
+    """
+    return await session.run_sync(functions_for_BD.get_product_version, id_product)
+
+
+async def get_order_version(session: AsyncSession, id_order: int, expand_items: bool = False) -> Optional[Row]:
+    """
+    Асинхронное получение версии заказа для ETag.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_order: ID заказа.
+    :param expand_items: True для ответа с позициями (expand=items).
+    :return: Строка (version, products_updated_at, items_count) или None, если заказ не найден.
+    """
+    return await session.run_sync(functions_for_BD.get_order_version, id_order, expand_items)
+
+
+async def get_changes(session: AsyncSession, entity: str, limit: int, since: Optional[datetime] = None, after_id: Optional[int] = None, settle_lag: float = 0.0) -> tuple[List[Row], List[Row]]:
+    """
+    Асинхронное получение ленты изменений таблицы.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param entity: Таблица: products или orders.
+    :param limit: Максимальное количество изменений.
+    :param since: Время изменения из курсора предыдущей страницы. None для чтения с начала.
+    :param after_id: ID из курсора предыдущей страницы.
+    :param settle_lag: Задержка отдачи изменений в секундах.
+    :return: Список изменений (changed_at, id, deleted) и строки измененных записей.
+    """
+    return await session.run_sync(functions_for_BD.get_changes, entity, limit, since, after_id, settle_lag)
+
+
+async def stream_products(session: AsyncSession, after: Optional[int] = None, chunk_size: int = 1000) -> AsyncIterator[List[Row]]:
+    """
+    Потоковое чтение продуктов кортежами колонок по возрастанию id.
+    Строки читаются порциями по chunk_size (yield_per), поэтому в памяти одновременно находится только одна порция.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param after: ID, после которого начинается чтение. None для чтения с начала таблицы.
+    :param chunk_size: Размер порции, получаемой из БД за один раз.
+    :return: Асинхронный итератор порций строк.
+    """
+    query = functions_for_BD.select_product_rows(after).execution_options(yield_per=chunk_size)
+    result = await session.stream(query)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def stream_orders(session: AsyncSession, after: Optional[int] = None, chunk_size: int = 1000, filters: Optional[OrderFilter] = None) -> AsyncIterator[List[Row]]:
+    """
+    Потоковое чтение заказов кортежами колонок по возрастанию id порциями по chunk_size (yield_per).
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param after: ID, после которого начинается чтение. None для чтения с начала таблицы.
+    :param chunk_size: Размер порции, получаемой из БД за один раз.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Асинхронный итератор порций строк.
+    """
+    query = functions_for_BD.select_order_rows(after, filters).execution_options(yield_per=chunk_size)
+    result = await session.stream(query)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def stream_order_export(session: AsyncSession, chunk_size: int = 1000, filters: Optional[OrderFilter] = None) -> AsyncIterator[List[Row]]:
+    """
+    Потоковое чтение выгрузки заказов с позициями и товарами порциями по chunk_size.
+    Используется курсор на стороне сервера (stream, yield_per), поэтому память не зависит от размера выгрузки.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param chunk_size: Размер порции, получаемой из БД за один раз.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Асинхронный итератор порций строк с колонками EXPORT_COLUMNS.
+    """
+    query = functions_for_BD.select_order_export_rows(filters).execution_options(yield_per=chunk_size)
+    result = await session.stream(query)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def get_product_response(session: AsyncSession, id_product: int, read_cache: bool = True, fill_cache: bool = True) -> Optional[ProductResponse]:
+    """
+    Асинхронное получение сериализованного продукта по ID через кэш.
+    При попадании в кэш запрос к БД не выполняется.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_product: ID продукта.
+    :param read_cache: False, чтобы читать продукт из БД без проверки кэша.
+    :param fill_cache: False, чтобы не сохранять прочитанный из БД продукт в кэш.
+    :return: ProductResponse или None, если продукт не найден.
+    """
+    product_response = product_cache.get(id_product) if read_cache else None
+    if product_response is None:
+        product_response = await session.run_sync(functions_for_BD.load_product_response, id_product, fill_cache)
+    return product_response
+
+
+async def get_product_responses(session: AsyncSession, ids_product: List[int], read_cache: bool = True, fill_cache: bool = True) -> Dict[int, ProductResponse]:
+    """
+    Асинхронное получение нескольких продуктов по списку ID через кэш.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param ids_product: Список ID продуктов.
+    :param read_cache: False, чтобы читать все продукты из БД без проверки кэша.
+    :param fill_cache: False, чтобы не сохранять прочитанные из БД продукты в кэш.
+    :return: Словарь ID -> ProductResponse для найденных продуктов.
+    """
+    return await session.run_sync(functions_for_BD.get_product_responses, ids_product, read_cache, fill_cache)
+
+
+async def get_order_by_id(session: AsyncSession, id_order: int) -> Optional[Order]:
+    """
+    Асинхронное получение закакза по ID из таблицы Order
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_order: ID обьекта в Order, который нужно вернуть
+    :return: обьект Order
+    """
+    return await session.run_sync(functions_for_BD.get_order_by_id, id_order)
+
+
+async def get_order_detail(session: AsyncSession, id_order: int) -> Optional[OrderDetailResponse]:
+    """
+    Асинхронное получение заказа по ID вместе с позициями, товарами и стоимостью.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_order: ID заказа.
+    :return: OrderDetailResponse или None, если заказ не найден.
+    """
+    return await session.run_sync(functions_for_BD.get_order_detail, id_order)
+
+
+async def delete_product(session: AsyncSession, id_product: int) -> int:
+    """
+    Асинхронное удаление продукта по его ID вместе со связанными записями OrderItem
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_product: ID продукта, который нужно удалить.
+    :return: 1 если продукт удален. 0 если продукт не найден. -1 если произошла ошибка
+    """
+    return await session.run_sync(functions_for_BD.delete_product, id_product)
+
+
+async def archive_product(session: AsyncSession, id_product: int) -> int:
+    """
+    Асинхронное архивирование продукта (мягкое удаление) без изменения состава заказов.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_product: ID продукта, который нужно архивировать.
+    :return: 1 если продукт архивирован. 0 если продукт не найден или уже архивирован. -1 если произошла ошибка
+    """
+    return await session.run_sync(functions_for_BD.archive_product, id_product)
+
+
+async def set_stock_shards(session: AsyncSession, id_product: int, count: int) -> int:
+    """
+    Асинхронное включение, изменение или отключение деления остатка товара на части.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_product: ID товара.
+    :param count: Количество частей остатка. 0 отключает деление.
+    :return: count, если изменение выполнено. -1 если товар не найден. -2 если произошла ошибка
+    """
+    return await session.run_sync(functions_for_BD.set_stock_shards, id_product, count)
+
+
+async def delete_order(session: AsyncSession, id_order: int) -> int:
+    """
+    Асинхронное удаление заказа из таблицы заказов.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_order: ID заказа, который нужно удалить.
+    :return: 1 если заказ удален. 0 если заказ не найден. -1 если произошла ошибка
+    """
+    return await session.run_sync(functions_for_BD.delete_order, id_order)
+
+
+async def update_product_info(session: AsyncSession, id_product: int, new_name_product: Optional[str] = None, new_description_product: Optional[str] = None, new_price_product: Optional[float] = None, new_quantity: Optional[int] = None, expected_version: Optional[int] = None) -> tuple[str, Optional[Row]]:
+    """
+    Асинхронное обновление информации о продукте по его ID одним условным UPDATE.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_product: ID продукта для обновления.
+    :param new_name_product: Новое имя продукта.
+    :param new_description_product: Новое описание продукта.
+    :param new_price_product: Новая цена продукта.
+    :param new_quantity: Новое количество на складе.
+    :param expected_version: Версия продукта, которую видел клиент. None без проверки версии.
+    :return: Строка с информацией о результате работы функции и строка продукта после изменения или None.
+    """
+    return await session.run_sync(functions_for_BD.update_product_info, id_product, new_name_product, new_description_product, new_price_product, new_quantity, expected_version)
+
+
+async def update_order_status(session: AsyncSession, id_order: int, new_status: OrderStatus, expected_version: Optional[int] = None) -> tuple[str, Optional[Row]]:
+    """
+    Асинхронное обновление статуса заказа по ID одним условным UPDATE.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param id_order: ID заказа для обновления.
+    :param new_status: Новый статус заказа.
+    :param expected_version: Версия заказа, которую видел клиент. None без проверки версии.
+    :return: Строка с информацией о результате работы функции и строка заказа после изменения или None.
+    """
+    return await session.run_sync(functions_for_BD.update_order_status, id_order, new_status, expected_version)
+
+
+async def update_orders_status(session: AsyncSession, new_status: OrderStatus, ids: Optional[List[int]] = None, filters: Optional[OrderFilter] = None) -> tuple[str, List[int]]:
+    """
+    Асинхронное обновление статуса группы заказов одним UPDATE.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param new_status: Новый статус заказов.
+    :param ids: Список ID заказов. Если None, используются filters.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Строка с информацией о результате работы функции и список ID измененных заказов.
+    """
+    return await session.run_sync(functions_for_BD.update_orders_status, new_status, ids, filters)
+
+
+async def get_top_products(session: AsyncSession, limit: int, filters: Optional[OrderFilter] = None, use_summary: bool = False) -> List[Row]:
+    """
+    Асинхронное получение товаров с наибольшим количеством проданных единиц за период.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param limit: Количество товаров в отчете.
+    :param filters: Условия отбора заказов по статусу и дате.
+    :param use_summary: True для расчета по сводке DailySales.
+    :return: Список строк (product_id, name, quantity, revenue).
+    """
+    return await session.run_sync(functions_for_BD.get_top_products, limit, filters, use_summary)
+
+
+async def get_revenue_by_day(session: AsyncSession, filters: Optional[OrderFilter] = None, use_summary: bool = False) -> List[Row]:
+    """
+    Асинхронное получение количества проданных единиц и выручки по дням и статусам заказов.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param filters: Условия отбора заказов по статусу и дате.
+    :param use_summary: True для расчета по сводке DailySales.
+    :return: Список строк (day, status, quantity, revenue).
+    """
+    return await session.run_sync(functions_for_BD.get_revenue_by_day, filters, use_summary)
+
+
+async def get_low_stock_products(session: AsyncSession, threshold: int, limit: Optional[int] = None) -> List[Row]:
+    """
+    Асинхронное получение продуктов с остатком меньше порога.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param threshold: Порог остатка на складе.
+    :param limit: Максимальное количество продуктов. None для всех продуктов.
+    :return: Список строк с колонками продукта.
+    """
+    return await session.run_sync(functions_for_BD.get_low_stock_products, threshold, limit)
+
+
+async def refresh_daily_sales(session: AsyncSession) -> int:
+    """
+    Асинхронный инкрементальный пересчет сводки продаж по дням.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :return: Количество пересчитанных дней или -1 если произошла ошибка.
+    """
+    return await session.run_sync(functions_for_BD.refresh_daily_sales)
+
+
+async def claim_idempotency_key(session: AsyncSession, scope: str, key: str, request_hash: str, ttl: float) -> Optional[Row]:
+    """
+    Асинхронное занятие ключа идемпотентности.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param scope: Метод и путь запроса.
+    :param key: Значение заголовка Idempotency-Key.
+    :param request_hash: Хэш тела запроса.
+    :param ttl: Время хранения ответа в секундах.
+    :return: None, если ключ занят этим запросом, иначе строка (request_hash, status_code, response_body).
+    """
+    return await session.run_sync(idempotency.claim_idempotency_key, scope, key, request_hash, ttl)
+
+
+async def save_idempotent_response(session: AsyncSession, scope: str, key: str, status_code: int, response_body: bytes) -> None:
+    """
+    Асинхронное сохранение ответа для занятого ключа идемпотентности.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param scope: Метод и путь запроса.
+    :param key: Значение заголовка Idempotency-Key.
+    :param status_code: Код ответа.
+    :param response_body: Тело ответа.
+    """
+    await session.run_sync(idempotency.save_idempotent_response, scope, key, status_code, response_body)
+
+
+async def release_idempotency_key(session: AsyncSession, scope: str, key: str) -> None:
+    """
+    Асинхронное освобождение ключа идемпотентности.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param scope: Метод и путь запроса.
+    :param key: Значение заголовка Idempotency-Key.
+    """
+    await session.run_sync(idempotency.release_idempotency_key, scope, key)
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Dict, Optional
+from app.schemas import ProductResponse
+from app.get_session_maker import settings
+
+#Кэш товаров внутри процесса приложения.
+#Каждый процесс uvicorn держит свой кэш, поэтому изменения, сделанные другим процессом,
+#становятся видны не позже чем через ttl секунд.
+
+class ProductCache:
+    """
+    Ограниченный по размеру LRU кэш сериализованных ProductResponse с временем жизни записей.
+    Ключ - ID товара.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        :param max_size: Максимальное количество записей. 0 отключает кэш.
+        :param ttl: Время жизни записи в секундах.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[int, tuple[float, ProductResponse]] = OrderedDict()
+        self._lock = Lock()
+        #Время последней инвалидации по ID товара. Не дает положить в кэш данные, прочитанные до изменения товара
+        self._invalidated_at: Dict[int, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id_product: int) -> Optional[ProductResponse]:
+        """
+        Получение товара из кэша.
+
+        :param id_product: ID товара.
+        :return: ProductResponse или None, если записи нет или она устарела.
+        """
+        with self._lock:
+            item = self._items.get(id_product)
+            if item is None or item[0] < monotonic():
+                if item is not None:
+                    del self._items[id_product]
+                self.misses += 1
+                return None
+            self._items.move_to_end(id_product)
+            self.hits += 1
+            return item[1]
+
+    def start_read(self) -> float:
+        """
+        Отметка времени начала чтения товара из БД. Передается в set.
+        """
+        return monotonic()
+
+    def set(self, id_product: int, product: ProductResponse, read_started: float) -> None:
+        """
+        Сохранение товара в кэш. Если товар был инвалидирован после начала чтения, запись не сохраняется,
+        так как прочитанные данные могли устареть.
+
+        :param id_product: ID товара.
+        :param product: Сериализованный товар.
+        :param read_started: Значение start_read(), полученное до чтения из БД.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if self._invalidated_at.get(id_product, float("-inf")) >= read_started:
+                return
+            self._items[id_product] = (monotonic() + self.ttl, product)
+            self._items.move_to_end(id_product)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *ids_product: int) -> None:
+        """
+        Удаление товаров из кэша после их изменения в БД.
+
+        :param ids_product: ID измененных товаров.
+        """
+        now = monotonic()
+        with self._lock:
+            for id_product in ids_product:
+                self._items.pop(id_product, None)
+                self._invalidated_at[id_product] = now
+            #Старые отметки больше не влияют на чтения, которые еще выполняются
+            if len(self._invalidated_at) > max(self.max_size, 1024):
+                horizon = now - max(self.ttl, 60.0)
+                self._invalidated_at = {key: value for key, value in self._invalidated_at.items() if value > horizon}
+
+    def clear(self) -> None:
+        """
+        Полная очистка кэша.
+        """
+        now = monotonic()
+        with self._lock:
+            for id_product in self._items:
+                self._invalidated_at[id_product] = now
+            self._items.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики работы кэша.
+        """
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+product_cache = ProductCache(settings.product_cache_size, settings.product_cache_ttl)
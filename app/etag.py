@@ -0,0 +1,75 @@
+from fastapi.responses import Response
+from hashlib import blake2b
+from typing import Optional
+from app.models import INT4_MAX
+
+#Условные запросы (ETag / If-None-Match / If-Match).
+#ETag строится из версии данных (ID и номер версии записи или count, max(id), max(updated_at) таблицы),
+#поэтому проверка If-None-Match выполняется одним легким запросом без чтения самих данных.
+
+def make_etag(*parts) -> str:
+    """
+    Формирование слабого ETag из версии данных.
+
+    :param parts: Значения, от которых зависит ответ (ID, updated_at, параметры запроса).
+    :return: Значение заголовка ETag.
+    """
+    digest = blake2b("|".join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def version_etag(id_record: int, version: int) -> str:
+    """
+    Формирование сильного ETag записи из ID и номера версии.
+    Такой ETag можно передать в If-Match при изменении записи.
+
+    :param id_record: ID записи.
+    :param version: Номер версии записи.
+    :return: Значение заголовка ETag.
+    """
+    return f'"{id_record}-{version}"'
+
+
+def if_match_version(if_match: Optional[str], id_record: int) -> Optional[int]:
+    """
+    Получение ожидаемой версии записи из заголовка If-Match.
+
+    :param if_match: Значение заголовка If-Match или None.
+    :param id_record: ID изменяемой записи.
+    :return: Номер версии. None, если заголовка нет или передан "*" (версия не проверяется).
+             0, если ETag не относится к записи: такой версии нет, поэтому изменение завершится конфликтом.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.split(",")[0].strip()
+    prefix = f'"{id_record}-'
+    if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit():
+        version = int(tag[len(prefix):-1])
+        return version if version <= INT4_MAX else 0 #Такой версии не может быть в БД
+    return 0
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Проверка заголовка If-None-Match. Сравнение слабое: префикс W/ не учитывается.
+
+    :param if_none_match: Значение заголовка If-None-Match или None.
+    :param etag: Текущий ETag ресурса.
+    :return: True, если у клиента актуальная версия ресурса.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    """
+    Ответ 304 Not Modified без тела.
+
+    :param etag: Текущий ETag ресурса.
+    :return: Response со статусом 304.
+    """
+    return Response(status_code=304, headers={"ETag": etag})
@@ -1,10 +1,11 @@
-from app.models import Product, Order, OrderItem, OrderStatus
-from sqlalchemy import  Integer, String, Float, DateTime
+from app.models import Product, Order, OrderItem, OrderStatus, DailySales, DailySalesDirtyDay, ProductStockShard, DeletedRecord, utcnow
+from sqlalchemy import  Integer, String, Float, Date, DateTime, Row, Select, case, update, insert, delete, func, select, literal, tuple_, union_all
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
-from datetime import datetime
-from typing import List, Optional
-from app.schemas import ProductInOrderRequest
+from sqlalchemy.orm import Session, contains_eager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from app.schemas import ProductInOrderRequest, ProductRequest, ProductResponse, OrderResponse, OrderItemResponse, OrderDetailResponse, OrderFilter
+from app.cache import product_cache
 
 def create_new_product(session: Session, name_product: String, description_product: String, price_product: Float, quantity: Integer) -> int:
     """
@@ -19,8 +20,6 @@ def create_new_product(session: Session, name_product: String, description_produ
     """
     try:
         new_product = Product(
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
             name=name_product,
             description=description_product,
             price=price_product,
@@ -38,31 +37,228 @@ def create_new_product(session: Session, name_product: String, description_produ
         return -1
 
 
+def create_products_bulk(session: Session, products: List[ProductRequest], batch_size: int) -> tuple[List[int], Optional[str]]:
+    """
+    Массовое создание товаров в таблице Product.
+    Товары вставляются пачками по batch_size строк одним INSERT ... RETURNING id (insertmanyvalues),
+    после каждой пачки выполняется один commit.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param products: Список товаров для создания.
+    :param batch_size: Количество товаров в одной пачке.
+    :return: Список ID созданных товаров в порядке входного списка и текст ошибки или None.
+             При ошибке возвращаются ID товаров из уже зафиксированных пачек.
+    """
+    ids: List[int] = []
+    try:
+        for start in range(0, len(products), batch_size):
+            batch = products[start:start + batch_size]
+            result = session.execute(
+                insert(Product).returning(Product.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "name": product.name,
+                        "description": product.description,
+                        "price": product.price,
+                        "stock_quantity": product.stock_quantity
+                    }
+                    for product in batch
+                ]
+            )
+            batch_ids = list(result.scalars())
+            session.commit()
+            ids.extend(batch_ids)
+        return ids, None
+
+    except SQLAlchemyError as e:
+        # В случае ошибки откатывается только текущая пачка
+        session.rollback()
+        return ids, f"Error: {e}"
+
+
+def sum_quantities(products: List[ProductInOrderRequest]) -> Dict[int, int]:
+    """
+    Суммирует количество по каждому товару заказа, чтобы повторяющиеся строки проверялись вместе
+
+    :param products: Список товаров в заказе
+    :return: Словарь ID товара -> общее количество, отсортированный по ID
+    """
+    quantities: Dict[int, int] = {}
+    for product in products:
+        quantities[product.product_id] = quantities.get(product.product_id, 0) + product.quantity
+    return dict(sorted(quantities.items()))
+
+
 def checking_quantity(session: Session, products: List[ProductInOrderRequest]) -> int:
     """
-    Проходит по списку товаров в заказе и проверяет их доступность по колличеству
+    Проверяет доступность всех товаров заказа по колличеству одним запросом
 
     :param session: Сессия SQLAlchemy
     :param products: Список товаров в заказе
-    :return: Id нехватающего товара или -1
+    :return: Id нехватающего товара, -2 если товар не найден или -1
     """
-    for product in products:
-        ex_product = get_product_by_id(session, product.product_id) #Получаем экземпляр товара
-        if ex_product:
-            if ex_product.stock_quantity < product.quantity:#Проверка колличества
-                return product.product_id #Если нехватка товара, вернет его ID
-        else: 
+    quantities = sum_quantities(products)
+    #Получение остатков всех товаров заказа одним запросом
+    stock = dict(session.query(Product.id, Product.total_stock).filter(Product.id.in_(quantities.keys()), Product.archived_at.is_(None)).all())
+    for product_id, quantity in quantities.items():
+        if product_id not in stock:
             return -2
+        if stock[product_id] < quantity:#Проверка колличества
+            return product_id #Если нехватка товара, вернет его ID
     return -1
-    
+
+
+def reserve_stock(session: Session, quantities: Dict[int, int]) -> List[int]:
+    """
+    Списывает количество товаров одним условным UPDATE ... WHERE stock_quantity >= :qty RETURNING id.
+    Строка обновляется только если остатка хватает, а БД блокирует строку до конца транзакции,
+    поэтому параллельные заказы не могут продать больше, чем есть на складе.
+    Товары, остаток которых разделен на части (product_stock_shards), списываются из частей функцией reserve_sharded_stock.
+    Фиксация транзакции остается за вызывающей функцией.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param quantities: Словарь ID товара -> количество для списания.
+    :return: Список ID товаров, которые удалось списать.
+    """
+    if not quantities:
+        return []
+    quantity_by_id = case(quantities, value=Product.id) #Количество для списания в зависимости от ID строки
+    result = session.execute(
+        update(Product)
+        .where(Product.id.in_(quantities.keys()), Product.stock_quantity >= quantity_by_id, Product.archived_at.is_(None))
+        .values(stock_quantity=Product.stock_quantity - quantity_by_id, version=Product.version + 1, updated_at=utcnow())
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    reserved = list(result.scalars())
+    #У популярного товара остаток в products равен 0, поэтому он не списан первым запросом
+    for product_id, quantity in quantities.items():
+        if product_id not in reserved and reserve_sharded_stock(session, product_id, quantity):
+            reserved.append(product_id)
+    return reserved
+
+
+def reserve_sharded_stock(session: Session, id_product: int, quantity: int) -> bool:
+    """
+    Списывает количество товара из частей остатка.
+    Сначала одним UPDATE списывается из случайной части с достаточным остатком, которая не заблокирована другим заказом
+    (FOR UPDATE SKIP LOCKED), поэтому параллельные заказы списывают из разных строк.
+    Если такой части нет, блокируются все части товара и количество списывается из нескольких частей.
+    Фиксация транзакции остается за вызывающей функцией.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_product: ID товара.
+    :param quantity: Количество для списания.
+    :return: True, если количество списано. False, если остатка не хватает, у товара нет частей остатка или товар архивирован.
+    """
+    #Части остатка архивного товара остаются в таблице, поэтому списание проверяет товар
+    active = select(Product.id).where(Product.id == id_product, Product.archived_at.is_(None)).exists()
+    free_shard = (
+        select(ProductStockShard.shard)
+        .where(ProductStockShard.product_id == id_product, ProductStockShard.stock_quantity >= quantity)
+        .order_by(func.random())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    reserved = session.execute(
+        update(ProductStockShard)
+        .where(ProductStockShard.product_id == id_product, ProductStockShard.shard == free_shard, ProductStockShard.stock_quantity >= quantity, active)
+        .values(stock_quantity=ProductStockShard.stock_quantity - quantity, version=ProductStockShard.version + 1)
+        .returning(ProductStockShard.shard)
+    ).first()
+    if reserved is not None:
+        return True
+
+    #Запасной вариант: количество больше остатка любой свободной части
+    shards = session.execute(
+        select(ProductStockShard.shard, ProductStockShard.stock_quantity)
+        .where(ProductStockShard.product_id == id_product, active)
+        .order_by(ProductStockShard.shard)
+        .with_for_update()
+    ).all()
+    if sum(shard.stock_quantity for shard in shards) < quantity:
+        return False
+    remaining = quantity
+    for shard in shards:
+        taken = min(shard.stock_quantity, remaining)
+        if taken == 0:
+            continue
+        session.execute(
+            update(ProductStockShard)
+            .where(ProductStockShard.product_id == id_product, ProductStockShard.shard == shard.shard)
+            .values(stock_quantity=ProductStockShard.stock_quantity - taken, version=ProductStockShard.version + 1)
+        )
+        remaining -= taken
+        if remaining == 0:
+            break
+    return True
+
+
+def split_stock(quantity: int, count: int) -> List[int]:
+    """
+    Делит остаток на count частей, отличающихся не больше чем на 1.
+
+    :param quantity: Общий остаток.
+    :param count: Количество частей.
+    :return: Остатки частей по номерам частей.
+    """
+    return [quantity // count + (1 if shard < quantity % count else 0) for shard in range(count)]
+
+
+def set_stock_shards(session: Session, id_product: Integer, count: int) -> int:
+    """
+    Включение, изменение или отключение деления остатка товара на части.
+    Общий остаток сохраняется: при count > 0 он делится поровну между count частями, а stock_quantity товара становится 0,
+    при count = 0 части удаляются, а остаток возвращается в stock_quantity.
+    Версия товара увеличивается с учетом версий удаленных частей, поэтому общая версия (total_version) только растет.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_product: ID товара.
+    :param count: Количество частей остатка. 0 отключает деление.
+    :return: count, если изменение выполнено. -1 если товар не найден. -2 если произошла ошибка
+    """
+    try:
+        stock = session.execute(
+            select(Product.stock_quantity).where(Product.id == id_product, Product.archived_at.is_(None)).with_for_update()
+        ).scalar_one_or_none()
+        if stock is None:
+            session.rollback()
+            return -1
+        shards = session.execute(
+            select(ProductStockShard.stock_quantity, ProductStockShard.version)
+            .where(ProductStockShard.product_id == id_product)
+            .with_for_update()
+        ).all()
+        total_stock = stock + sum(shard.stock_quantity for shard in shards)
+        shards_version = sum(shard.version for shard in shards)
+
+        session.execute(delete(ProductStockShard).where(ProductStockShard.product_id == id_product))
+        if count > 0:
+            session.execute(insert(ProductStockShard), [
+                {"product_id": id_product, "shard": shard, "stock_quantity": quantity, "version": 0}
+                for shard, quantity in enumerate(split_stock(total_stock, count))
+            ])
+        session.execute(
+            update(Product)
+            .where(Product.id == id_product)
+            .values(stock_quantity=0 if count > 0 else total_stock, version=Product.version + 1 + shards_version, updated_at=utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        product_cache.invalidate(id_product)
+        return count
+    except SQLAlchemyError as e:
+        session.rollback()
+        return -2
+
 
 def create_new_order(session: Session, date_order: DateTime, status: OrderStatus, products: List[ProductInOrderRequest]) -> tuple[str, int, Optional[int]]:
     """
     Создание нового заказа в таблице Order.
-    1. Проверяется доступность всех товаров.
-    2. Добавляется заказ.
-    3.1 Добавляются все элементы ProductInOrderRequest
-    3.2 Меняется значение количества доступного товара
+    1. Списывается количество всех товаров одним условным UPDATE.
+    2. Если хотя бы один товар не списан, транзакция откатывается и определяется причина.
+    3. Добавляется заказ и все элементы ProductInOrderRequest.
 
     :param session: Объект сессии SQLAlchemy.
     :param date_order: Дата заказа
@@ -70,41 +266,43 @@ def create_new_order(session: Session, date_order: DateTime, status: OrderStatus
     :param products: Список товаров для добавления в заказ
     :return: ID созданного заказа с сообщением Succes или код ошибки и сообщение об ошибке.
     """
-    #Проверка колличетсва товара
-    result_checking = checking_quantity(session, products)
-    if result_checking != -1:
-        return f"There is not enough product with ID {result_checking}", result_checking, None
-    elif result_checking == -2:
-        return f"Uncorrect product id", result_checking, None
+    quantities = sum_quantities(products)
 
-    #Добавление заказа и товаров в заказ
     try:
+        #Списание количества товаров
+        reserved = reserve_stock(session, quantities)
+        if len(reserved) != len(quantities):
+            session.rollback()
+            #Определение причины только в случае ошибки
+            result_checking = checking_quantity(session, products)
+            if result_checking == -2:
+                return f"Uncorrect product id", result_checking, None
+            elif result_checking != -1:
+                return f"There is not enough product with ID {result_checking}", result_checking, None
+            else:
+                #Остатки изменились параллельным запросом между списанием и проверкой
+                return "There is not enough product", -3, None
+
         #Создание заказа
         new_order = Order(
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
             date=date_order,  
             status=status
         )
         session.add(new_order)
         session.flush()
 
-        for product in products:
-            #Создание запаиси в таблицу OrderItem
-            new_order_item = OrderItem(
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
+        #Создание записей в таблицу OrderItem
+        session.add_all([
+            OrderItem(
                 order_id= new_order.id,    
                 product_id= product.product_id,
                 quantity= product.quantity          
             )
-            session.add(new_order_item)
-
-            #Изменение количества товара
-            ex_product = get_product_by_id(session, product.product_id) #Получаем экземпляр товара
-            ex_product.stock_quantity -= new_order_item.quantity
+            for product in products
+        ])
             
         session.commit()
+        product_cache.invalidate(*reserved) #Остатки товаров изменились
         return "Success", 0, new_order.id
     
     except SQLAlchemyError as e:
@@ -113,6 +311,74 @@ def create_new_order(session: Session, date_order: DateTime, status: OrderStatus
         return f"Error: {e}", -1, None
     
 
+def create_orders_batch(session: Session, orders: List[tuple[DateTime, OrderStatus, List[ProductInOrderRequest]]]) -> List[tuple[str, int, Optional[int]]]:
+    """
+    Создание пачки заказов в одной транзакции (group commit).
+    1. Остатки всех товаров пачки (с учетом частей остатка) читаются одним запросом с блокировкой строк (SELECT ... FOR UPDATE).
+    2. Заказы проверяются по очереди поступления, заказ без достаточного остатка получает свою ошибку и не влияет на остальные.
+    3. Количество принятых заказов списывается одним условным UPDATE, заказы и элементы заказов добавляются пакетными INSERT.
+    4. Транзакция фиксируется один раз на всю пачку.
+    Если списание не прошло (остатки изменились без блокировки, например в SQLite или в частях остатка),
+    каждый заказ создается отдельно через create_new_order.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param orders: Список заказов (дата, статус, товары) в порядке поступления.
+    :return: Для каждого заказа, в том же порядке, результат как у create_new_order.
+    """
+    results: List[Optional[tuple[str, int, Optional[int]]]] = [None] * len(orders)
+    try:
+        product_ids = sorted({product.product_id for _, _, products in orders for product in products})
+        stock = dict(session.execute(
+            select(Product.id, Product.total_stock)
+            .where(Product.id.in_(product_ids), Product.archived_at.is_(None))
+            .order_by(Product.id)
+            .with_for_update(of=Product)
+        ).all())
+
+        #Распределение остатков между заказами в порядке поступления
+        accepted: List[int] = []
+        reserved: Dict[int, int] = {}
+        for index, (_, _, products) in enumerate(orders):
+            quantities = sum_quantities(products)
+            missing = next((product_id for product_id in quantities if product_id not in stock), None)
+            short = next((product_id for product_id, quantity in quantities.items() if stock.get(product_id, 0) < quantity), None)
+            if missing is not None:
+                results[index] = ("Uncorrect product id", -2, None)
+            elif short is not None:
+                results[index] = (f"There is not enough product with ID {short}", short, None)
+            else:
+                for product_id, quantity in quantities.items():
+                    stock[product_id] -= quantity
+                    reserved[product_id] = reserved.get(product_id, 0) + quantity
+                accepted.append(index)
+
+        if accepted:
+            if len(reserve_stock(session, dict(sorted(reserved.items())))) != len(reserved):
+                session.rollback()
+                return [create_new_order(session, date_order, status, products) for date_order, status, products in orders]
+
+            order_ids = session.scalars(
+                insert(Order).returning(Order.id, sort_by_parameter_order=True),
+                [{"date": orders[index][0], "status": orders[index][1], "version": 1} for index in accepted]
+            ).all()
+            session.execute(insert(OrderItem), [
+                {"order_id": order_id, "product_id": product.product_id, "quantity": product.quantity}
+                for index, order_id in zip(accepted, order_ids)
+                for product in orders[index][2]
+            ])
+            for index, order_id in zip(accepted, order_ids):
+                results[index] = ("Success", 0, order_id)
+
+        session.commit()
+        product_cache.invalidate(*reserved) #Остатки товаров изменились
+        return results
+
+    except SQLAlchemyError as e:
+        # В случае любой ошибки при работе с базой данных ни один заказ пачки не создается
+        session.rollback()
+        return [(f"Error: {e}", -1, None)] * len(orders)
+
+
 def get_products(session: Session) -> List[Product]:
     """
     Получение всех продуктов из базы данных.
@@ -121,22 +387,261 @@ def get_products(session: Session) -> List[Product]:
     :return: Список объектов Product.
     """
     # Запрос всех объектов Product из базы данных
-    products = session.query(Product).all() 
+    products = session.query(Product).filter(Product.archived_at.is_(None)).all() 
     return products
 
 
-def get_orders(session: Session) -> List[Order]:
+def filter_orders(query, filters: Optional[OrderFilter]):
+    """
+    Добавляет к запросу заказов условия по статусу и периоду даты заказа.
+    Условия обслуживаются составным индексом ix_orders_status_date.
+
+    :param query: Query или Select по таблице Order.
+    :param filters: Условия отбора или None.
+    :return: Запрос с условиями.
+    """
+    if filters is None:
+        return query
+    if filters.status is not None:
+        query = query.filter(Order.status == filters.status)
+    if filters.date_from is not None:
+        query = query.filter(Order.date >= filters.date_from)
+    if filters.date_to is not None:
+        query = query.filter(Order.date < filters.date_to)
+    return query
+
+
+def get_orders(session: Session, filters: Optional[OrderFilter] = None) -> List[Order]:
     """
     Получение всех заказов из базы данных.
 
     :param session: Объект сессии SQLAlchemy.
+    :param filters: Условия отбора по статусу и дате заказа.
     :return: Список объектов Order.
     """
-    # Запрос всех объектов Product из базы данных
-    orders = session.query(Order).all() 
+    # Запрос всех объектов Order из базы данных
+    orders = filter_orders(session.query(Order), filters).all() 
     return orders
 
 
+#Колонки для ответов со списками. Списки читаются кортежами колонок, без создания ORM объектов и identity map
+#Остаток и версия продукта берутся с учетом частей остатка
+PRODUCT_COLUMNS = [getattr(Product, {"stock_quantity": "total_stock", "version": "total_version"}.get(name, name)).label(name) for name in ProductResponse.model_fields]
+ORDER_COLUMNS = [getattr(Order, name) for name in OrderResponse.model_fields]
+
+
+def select_product_rows(after: Optional[int] = None) -> Select:
+    """
+    Запрос колонок продуктов по возрастанию id с пагинацией по ключу (keyset по id).
+    Вместо OFFSET используется условие id > after, поэтому стоимость запроса не зависит от номера страницы.
+
+    :param after: ID последнего продукта предыдущей страницы. None для чтения с начала таблицы.
+    :return: Select по колонкам PRODUCT_COLUMNS.
+    """
+    query = select(*PRODUCT_COLUMNS).where(Product.archived_at.is_(None)).order_by(Product.id)
+    if after is not None:
+        query = query.where(Product.id > after)
+    return query
+
+
+def select_order_rows(after: Optional[int] = None, filters: Optional[OrderFilter] = None) -> Select:
+    """
+    Запрос колонок заказов по возрастанию id с пагинацией по ключу (keyset по id) и условиями отбора.
+
+    :param after: ID последнего заказа предыдущей страницы. None для чтения с начала таблицы.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Select по колонкам ORDER_COLUMNS.
+    """
+    query = filter_orders(select(*ORDER_COLUMNS), filters).order_by(Order.id)
+    if after is not None:
+        query = query.where(Order.id > after)
+    return query
+
+
+#Колонки выгрузки заказов: заказ, позиция заказа и товар
+EXPORT_COLUMNS = [
+    Order.id.label("order_id"), Order.date.label("order_date"), Order.status, Order.created_at, Order.updated_at,
+    OrderItem.id.label("item_id"), OrderItem.product_id, Product.name.label("product_name"),
+    OrderItem.quantity, Product.price, (OrderItem.quantity * Product.price).label("line_total")
+]
+EXPORT_FIELDS = list(select(*EXPORT_COLUMNS).selected_columns.keys())
+
+
+def select_order_export_rows(filters: Optional[OrderFilter] = None) -> Select:
+    """
+    Запрос выгрузки заказов: одна строка на позицию заказа с названием и ценой товара (JOIN orders, order_items, products).
+    Строки упорядочены по ID заказа, поэтому позиции одного заказа идут подряд.
+    Архивные товары входят в выгрузку, так как остаются в истории заказов.
+
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Select по колонкам EXPORT_COLUMNS.
+    """
+    query = (
+        select(*EXPORT_COLUMNS)
+        .select_from(Order)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(Product, Product.id == OrderItem.product_id)
+        .order_by(Order.id, OrderItem.id)
+    )
+    return filter_orders(query, filters)
+
+
+def get_product_rows(session: Session, limit: Optional[int] = None, after: Optional[int] = None) -> List[Row]:
+    """
+    Получение продуктов кортежами колонок PRODUCT_COLUMNS.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param limit: Максимальное количество продуктов. None для всех продуктов.
+    :param after: ID последнего продукта предыдущей страницы. None для первой страницы.
+    :return: Список строк, отсортированный по id.
+    """
+    query = select_product_rows(after)
+    if limit is not None:
+        query = query.limit(limit)
+    return session.execute(query).all()
+
+
+def get_order_rows(session: Session, limit: Optional[int] = None, after: Optional[int] = None, filters: Optional[OrderFilter] = None) -> List[Row]:
+    """
+    Получение заказов кортежами колонок ORDER_COLUMNS.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param limit: Максимальное количество заказов. None для всех заказов.
+    :param after: ID последнего заказа предыдущей страницы. None для первой страницы.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Список строк, отсортированный по id.
+    """
+    query = select_order_rows(after, filters)
+    if limit is not None:
+        query = query.limit(limit)
+    return session.execute(query).all()
+
+
+def get_products_version(session: Session, limit: Optional[int] = None, after: Optional[int] = None) -> Row:
+    """
+    Версия списка или страницы продуктов для ETag: количество, максимальный id, максимальный updated_at, сумма версий продуктов и частей остатка.
+    Добавление, удаление и изменение продукта меняют хотя бы одно из значений.
+    updated_at задается временем начала транзакции и может не увеличить максимум, поэтому изменение учитывается и по сумме версий.
+    Для страницы (limit, after) агрегируются только строки страницы, поэтому стоимость не зависит от размера таблицы.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param limit: Размер страницы. None для всех продуктов.
+    :param after: ID последнего продукта предыдущей страницы. None для чтения с начала таблицы.
+    :return: Строка (count, max_id, max_updated_at, sum_version, shards_version).
+    """
+    page = select(Product.id, Product.updated_at, Product.version).where(Product.archived_at.is_(None))
+    if after is not None:
+        page = page.where(Product.id > after)
+    if limit is not None:
+        page = page.order_by(Product.id).limit(limit)
+    page = page.subquery()
+    shards_version = (
+        select(func.coalesce(func.sum(ProductStockShard.version), 0))
+        .where(ProductStockShard.product_id.in_(select(page.c.id)))
+        .scalar_subquery()
+    )
+    query = select(func.count(), func.max(page.c.id), func.max(page.c.updated_at), func.sum(page.c.version), shards_version)
+    return session.execute(query).one()
+
+
+def get_orders_version(session: Session, filters: Optional[OrderFilter] = None, limit: Optional[int] = None, after: Optional[int] = None) -> Row:
+    """
+    Версия списка или страницы заказов для ETag с учетом условий отбора.
+    Для страницы (limit, after) агрегируются только строки страницы.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :param limit: Размер страницы. None для всех заказов.
+    :param after: ID последнего заказа предыдущей страницы. None для чтения с начала таблицы.
+    :return: Строка (count, max_id, max_updated_at, sum_version).
+    """
+    page = filter_orders(select(Order.id, Order.updated_at, Order.version), filters)
+    if after is not None:
+        page = page.where(Order.id > after)
+    if limit is not None:
+        page = page.order_by(Order.id).limit(limit)
+    page = page.subquery()
+    query = select(func.count(), func.max(page.c.id), func.max(page.c.updated_at), func.sum(page.c.version))
+    return session.execute(query).one()
+
+
+def get_product_version(session: Session, id_product: Integer) -> Optional[int]:
+    """
+    Версия продукта для ETag и If-Match.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_product: ID продукта.
+    :return: Номер версии продукта с учетом частей остатка или None, если продукт не найден.
+    """
+    query = select(Product.total_version).where(Product.id == id_product, Product.archived_at.is_(None))
+    return session.execute(query).scalar_one_or_none()
+
+
+def get_order_version(session: Session, id_order: Integer, expand_items: bool = False) -> Optional[Row]:
+    """
+    Версия заказа для ETag: номер версии заказа,
+    а для ответа с позициями еще и последнее изменение товаров в заказе и количество позиций.
+    Позиции удаляются вместе с товаром (delete_product) без изменения заказа, поэтому учитывается их количество.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_order: ID заказа.
+    :param expand_items: True для ответа с позициями (expand=items).
+    :return: Строка (version, products_updated_at, items_count) или None, если заказ не найден.
+    """
+    products_updated_at = items_count = None
+    if expand_items:
+        products_updated_at = (
+            select(func.max(Product.updated_at))
+            .join(OrderItem, OrderItem.product_id == Product.id)
+            .where(OrderItem.order_id == id_order)
+            .scalar_subquery()
+        )
+        items_count = select(func.count()).where(OrderItem.order_id == id_order).scalar_subquery()
+    query = select(Order.version, products_updated_at, items_count).where(Order.id == id_order)
+    return session.execute(query).first()
+
+
+#Таблицы ленты изменений: модель и колонки ответа
+CHANGE_FEEDS = {"products": (Product, PRODUCT_COLUMNS), "orders": (Order, ORDER_COLUMNS)}
+
+
+def get_changes(session: Session, entity: str, limit: int, since: Optional[datetime] = None, after_id: Optional[int] = None, settle_lag: float = 0.0) -> tuple[List[Row], List[Row]]:
+    """
+    Лента изменений таблицы для синхронизации внешних систем.
+    Изменения упорядочены по курсору (время изменения, id): измененные строки по updated_at
+    и записи об удалении из DeletedRecord по deleted_at. Архивный продукт отдается как удаленный.
+    Выборка идет по индексам (updated_at, id), поэтому стоимость зависит от количества изменений, а не от размера таблицы.
+    Время изменения задается в начале транзакции, поэтому изменения младше settle_lag секунд не отдаются:
+    транзакция, зафиксированная позже, не окажется позади курсора клиента.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param entity: Таблица из CHANGE_FEEDS: products или orders.
+    :param limit: Максимальное количество изменений.
+    :param since: Время изменения из курсора предыдущей страницы. None для чтения с начала.
+    :param after_id: ID из курсора предыдущей страницы.
+    :param settle_lag: Задержка отдачи изменений в секундах.
+    :return: Список изменений (changed_at, id, deleted) по возрастанию курсора
+             и строки измененных записей (колонки из CHANGE_FEEDS) в том же порядке.
+    """
+    model, columns = CHANGE_FEEDS[entity]
+    deleted = model.archived_at.is_not(None) if model is Product else literal(False)
+    changes = union_all(
+        select(model.updated_at.label("changed_at"), model.id.label("id"), deleted.label("deleted")),
+        select(DeletedRecord.deleted_at, DeletedRecord.record_id, literal(True)).where(DeletedRecord.entity == entity)
+    ).subquery()
+
+    settled_at = session.execute(select(utcnow())).scalar() - timedelta(seconds=settle_lag)
+    query = select(changes).where(changes.c.changed_at <= settled_at).order_by(changes.c.changed_at, changes.c.id).limit(limit)
+    if since is not None:
+        query = query.where(tuple_(changes.c.changed_at, changes.c.id) > tuple_(since, after_id or 0))
+    entries = session.execute(query).all()
+
+    changed_ids = [entry.id for entry in entries if not entry.deleted]
+    rows = {row.id: row for row in session.execute(select(*columns).where(model.id.in_(changed_ids))).all()} if changed_ids else {}
+    #Строка могла быть удалена между запросами, тогда она придет в ленте как удаленная
+    return entries, [rows[id_record] for id_record in changed_ids if id_record in rows]
+
+
 def get_product_by_id(session: Session, id_product: Integer) -> Optional[Product]:
     """
     Получение продукта по ID из таблицы Product
@@ -146,10 +651,75 @@ def get_product_by_id(session: Session, id_product: Integer) -> Optional[Product
     :return: объект Product.
     """
     #Фильтрация всех продуктов по айди и получение первого
-    product = session.query(Product).filter(Product.id == id_product).first()
+    product = session.query(Product).filter(Product.id == id_product, Product.archived_at.is_(None)).first()
     return product
 
 
+def load_product_response(session: Session, id_product: Integer, fill_cache: bool = True) -> Optional[ProductResponse]:
+    """
+    Чтение продукта из БД и сохранение его сериализованной версии в кэш.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_product: ID продукта.
+    :param fill_cache: False, чтобы не сохранять продукт в кэш (чтение из реплики, которая может отставать).
+    :return: ProductResponse или None, если продукт не найден.
+    """
+    read_started = product_cache.start_read()
+    product = get_product_by_id(session, id_product)
+    if product is None:
+        return None
+    product_response = ProductResponse.model_validate(product)
+    if fill_cache:
+        product_cache.set(id_product, product_response, read_started)
+    return product_response
+
+
+def get_product_response(session: Session, id_product: Integer, read_cache: bool = True, fill_cache: bool = True) -> Optional[ProductResponse]:
+    """
+    Получение сериализованного продукта по ID через кэш.
+    Если продукта нет в кэше, он читается из БД и сохраняется в кэш.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_product: ID продукта.
+    :param read_cache: False, чтобы читать продукт из БД без проверки кэша.
+    :param fill_cache: False, чтобы не сохранять прочитанный из БД продукт в кэш.
+    :return: ProductResponse или None, если продукт не найден.
+    """
+    product_response = product_cache.get(id_product) if read_cache else None
+    if product_response is None:
+        product_response = load_product_response(session, id_product, fill_cache)
+    return product_response
+
+
+def get_product_responses(session: Session, ids_product: List[int], read_cache: bool = True, fill_cache: bool = True) -> Dict[int, ProductResponse]:
+    """
+    Получение нескольких продуктов по списку ID через кэш.
+    Продукты, которых нет в кэше, читаются из БД одним запросом WHERE id IN (...) и сохраняются в кэш.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param ids_product: Список ID продуктов.
+    :param read_cache: False, чтобы читать все продукты из БД без проверки кэша.
+    :param fill_cache: False, чтобы не сохранять прочитанные из БД продукты в кэш.
+    :return: Словарь ID -> ProductResponse для найденных продуктов.
+    """
+    products: Dict[int, ProductResponse] = {}
+    for id_product in ids_product if read_cache else []:
+        product_response = product_cache.get(id_product)
+        if product_response is not None:
+            products[id_product] = product_response
+
+    missing = [id_product for id_product in ids_product if id_product not in products]
+    if missing:
+        read_started = product_cache.start_read()
+        rows = session.execute(select(*PRODUCT_COLUMNS).where(Product.id.in_(missing), Product.archived_at.is_(None))).all()
+        for row in rows:
+            product_response = ProductResponse.model_validate(row)
+            if fill_cache:
+                product_cache.set(row.id, product_response, read_started)
+            products[row.id] = product_response
+    return products
+
+
 def get_order_by_id(session: Session, id_order: Integer) -> Optional[Order]:
     """
     Получение закакза по ID из таблицы Order
@@ -163,32 +733,107 @@ def get_order_by_id(session: Session, id_order: Integer) -> Optional[Order]:
     return order
 
 
+def get_order_detail(session: Session, id_order: Integer) -> Optional[OrderDetailResponse]:
+    """
+    Получение заказа по ID вместе с позициями и товарами за постоянное число запросов (2 запроса).
+    Позиции загружаются одним запросом с JOIN товаров (contains_eager),
+    стоимость каждой позиции и всего заказа вычисляется в SQL.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_order: ID заказа.
+    :return: OrderDetailResponse или None, если заказ не найден.
+    """
+    order = get_order_by_id(session, id_order)
+    if order is None:
+        return None
+
+    line_total = OrderItem.quantity * Product.price
+    rows = (
+        session.query(OrderItem, line_total.label("line_total"), func.sum(line_total).over().label("order_total"))
+        .join(OrderItem.product)
+        .options(contains_eager(OrderItem.product))
+        .filter(OrderItem.order_id == id_order)
+        .order_by(OrderItem.id)
+        .all()
+    )
+
+    items = [
+        OrderItemResponse(
+            id=item.id,
+            product_id=item.product_id,
+            quantity=item.quantity,
+            line_total=item_total,
+            product=ProductResponse.model_validate(item.product)
+        )
+        for item, item_total, _ in rows
+    ]
+    order_total = rows[0].order_total if rows else 0.0
+    return OrderDetailResponse(**OrderResponse.model_validate(order).model_dump(), items=items, total=order_total)
+
+
 def delete_product(session: Session, id_product: Integer) -> int:
     """
-    Удаляет продукт из базы данных по его ID, с удалением всех связанных запесей в таблице OrderItem
-    ?Теряются данные о составе заказа?
+    Удаляет продукт из базы данных по его ID, с удалением всех связанных запесей в таблице OrderItem.
+    Позиции, части остатка и продукт удаляются запросами DELETE без загрузки строк в сессию,
+    поэтому память не зависит от количества позиций заказов с этим продуктом.
+    Для ленты изменений добавляется запись в DeletedRecord.
+    Чтобы сохранить состав заказов, используется archive_product.
 
     :param session: Объект сессии SQLAlchemy.
     :param id_product: ID продукта, который нужно удалить.
     :return: 1 если продукт удален. 0 если продукт не найден. -1 если произошла ошибка
     """
-    product = session.query(Product).filter(Product.id == id_product).first() 
-    if product:
-        try:
-            # Удаление всех зависимых записей в OrderItem
-            order_items = session.query(OrderItem).filter(OrderItem.product_id == product.id).all()
-            for order_item in order_items:
-                session.delete(order_item)
-            # Удаление самого продукта
-            session.delete(product)
+    try:
+        # Дни заказов с продуктом пересчитываются в сводке продаж, так как позиции удаляются без изменения заказов
+        mark_sales_days_dirty(session, id_product)
+        # Удаление всех зависимых записей в OrderItem одним запросом
+        session.execute(delete(OrderItem).where(OrderItem.product_id == id_product))
+        session.execute(delete(ProductStockShard).where(ProductStockShard.product_id == id_product))
+        # Удаление самого продукта
+        result = session.execute(delete(Product).where(Product.id == id_product))
+        if result.rowcount == 0:
+            session.rollback()
+            return 0
+        # Запись об удалении для ленты изменений
+        session.execute(insert(DeletedRecord).values(entity="products", record_id=id_product))
 
-            session.commit()
+        session.commit()
+        product_cache.invalidate(id_product)
 
-            return 1
-        except SQLAlchemyError as e:
+        return 1
+    except SQLAlchemyError as e:
+        session.rollback()
+        return -1
+
+
+def archive_product(session: Session, id_product: Integer) -> int:
+    """
+    Архивирует продукт (мягкое удаление) одним UPDATE без изменения таблицы OrderItem.
+    Архивный продукт не возвращается в списках и по ID, не изменяется и не добавляется в новые заказы,
+    но остается в составе уже созданных заказов.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_product: ID продукта, который нужно архивировать.
+    :return: 1 если продукт архивирован. 0 если продукт не найден или уже архивирован. -1 если произошла ошибка
+    """
+    try:
+        result = session.execute(
+            update(Product)
+            .where(Product.id == id_product, Product.archived_at.is_(None))
+            .values(archived_at=utcnow(), version=Product.version + 1, updated_at=utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
             session.rollback()
-            return -1
-    return 0
+            return 0
+
+        session.commit()
+        product_cache.invalidate(id_product)
+
+        return 1
+    except SQLAlchemyError as e:
+        session.rollback()
+        return -1
 
 def delete_order(session: Session, id_order: Integer) -> int:
     """
@@ -202,6 +847,7 @@ def delete_order(session: Session, id_order: Integer) -> int:
     if order:
         try:
             session.delete(order)
+            session.add(DeletedRecord(entity="orders", record_id=id_order)) # Запись об удалении для ленты изменений
             session.commit()
             return 1
         except SQLAlchemyError as e:
@@ -210,11 +856,14 @@ def delete_order(session: Session, id_order: Integer) -> int:
     return 0
 
 
-def update_product_info(session: Session, id_product: Integer, new_name_product: Optional[String] = None, new_description_product: Optional[String] = None, new_price_product: Optional[Float] = None, new_quantity: Optional[Integer] = None) -> str:
+def update_product_info(session: Session, id_product: Integer, new_name_product: Optional[String] = None, new_description_product: Optional[String] = None, new_price_product: Optional[Float] = None, new_quantity: Optional[Integer] = None, expected_version: Optional[int] = None) -> tuple[str, Optional[Row]]:
     """
     Обновляет информацию о продукте по его ID.
     Если передается аргумент, то происходит соответствуещее изменение продукта.
     Если аргумент None, то параметр продукта не изменяется.
+    Изменение выполняется одним UPDATE ... WHERE id = :id AND version = :version RETURNING,
+    поэтому параллельное изменение продукта не может быть потеряно.
+    Если остаток продукта разделен на части, новый остаток делится поровну между частями.
 
     Args:
         session (Session): Сессия SQLAlchemy для взаимодействия с базой данных.
@@ -223,73 +872,301 @@ def update_product_info(session: Session, id_product: Integer, new_name_product:
         new_description_product (Optional[String], optional): Новое описание продукта. 
         new_price_product (Optional[Float], optional): Новая цена продукта.
         new_quantity (Optional[Integer], optional): Новое количество на складе.
+        expected_version (Optional[int], optional): Версия продукта, которую видел клиент. None без проверки версии.
 
     Returns:
-        String: Строка с информацией о результате работы функции.
+        tuple: Строка с информацией о результате работы функции и строка продукта (колонки PRODUCT_COLUMNS) после изменения или None.
     """
+    new_values = {
+        "name": new_name_product,
+        "description": new_description_product,
+        "price": new_price_product,
+        "stock_quantity": new_quantity
+    }
+    shard_count = 0
+    if new_quantity is not None:
+        shard_count = session.execute(select(func.count()).where(ProductStockShard.product_id == id_product)).scalar_one()
+        if shard_count > 0:
+            new_values["stock_quantity"] = 0 #Остаток хранится в частях
+    query = (
+        update(Product)
+        .where(Product.id == id_product, Product.archived_at.is_(None))
+        .values(**{key: value for key, value in new_values.items() if value is not None}, version=Product.version + 1, updated_at=utcnow())
+        .returning(*PRODUCT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    if expected_version is not None:
+        query = query.where(Product.total_version == expected_version) #Проверка версии в том же запросе
 
-    product = session.query(Product).filter(Product.id == id_product).first()
-
-    if product: #Если продукт найден выполняется обновление данных
-        current_update_at  = product.updated_at # Сохранение времени изменения для оптимистической блокировки данных
-
-        if new_name_product is not None:
-            product.name = new_name_product
-        if new_description_product is not None:
-            product.description = new_description_product
+    try:  # Обработка исключений
         if new_price_product is not None:
-            product.price = new_price_product
-        if new_quantity is not None:
-            product.stock_quantity = new_quantity
-
-        try:  # Обработка исключений
-            if current_update_at == product.updated_at: #Проверка изменения данных
-                session.commit()
-                return "Success"
-            else:
-                return "Integrity error"
-        except Exception as e:  # Обработка всех исключений
-            session.rollback()
-            return f"Error: {e}"
+            #Выручка в сводке продаж считается по цене товара, поэтому при изменении цены дни заказов с товаром пересчитываются
+            mark_sales_days_dirty(session, id_product, select(Product.id).where(Product.id == id_product, Product.price != new_price_product).exists())
+        product = session.execute(query).first()
+        if product is not None and shard_count > 0:
+            session.execute(
+                update(ProductStockShard)
+                .where(ProductStockShard.product_id == id_product)
+                .values(stock_quantity=case(dict(enumerate(split_stock(new_quantity, shard_count))), value=ProductStockShard.shard, else_=0), version=ProductStockShard.version + 1)
+            )
+            product = session.execute(select(*PRODUCT_COLUMNS).where(Product.id == id_product)).first()
+        if product is not None:
+            session.commit()
+        else:
+            session.rollback() #Отметки дней сводки не нужны, продукт не изменен
+    except SQLAlchemyError as e:  # Обработка ошибок БД
+        session.rollback()
+        return f"Error: {e}", None
 
-    else:
-        return "The product is not missing"
+    if product is None:
+        #Дополнительный запрос только при неудаче: продукт изменен другим запросом или не существует
+        if expected_version is not None and get_product_version(session, id_product) is not None:
+            return "Version conflict", None
+        return "The product is not missing", None
+
+    product_cache.invalidate(id_product)
+    return "Success", product
     
 
-def update_order_status(session: Session, id_order: Integer, new_status: OrderStatus) -> str:
+def update_order_status(session: Session, id_order: Integer, new_status: OrderStatus, expected_version: Optional[int] = None) -> tuple[str, Optional[Row]]:
     """
-    Обновляет статус заказа по ID.
+    Обновляет статус заказа по ID одним UPDATE ... WHERE id = :id AND version = :version RETURNING.
 
     Args:
         session (Session): Сессия SQLAlchemy для взаимодействия с базой данных.
         id_order (Integer): ID заказа для обновления.
         new_status  OrderStatus: Новый статус заказа. 
+        expected_version (Optional[int], optional): Версия заказа, которую видел клиент. None без проверки версии.
 
     Returns:
-        String: Строка с информацией о результате работы функции.
+        tuple: Строка с информацией о результате работы функции и строка заказа (колонки ORDER_COLUMNS) после изменения или None.
     """
+    query = (
+        update(Order)
+        .where(Order.id == id_order)
+        .values(status=new_status, version=Order.version + 1, updated_at=utcnow())
+        .returning(*ORDER_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    if expected_version is not None:
+        query = query.where(Order.version == expected_version) #Проверка версии в том же запросе
 
-    order = session.query(Order).filter(Order.id == id_order).first()
+    try:  # Обработка исключений
+        order = session.execute(query).first()
+        session.commit()
+    except SQLAlchemyError as e:  # Обработка ошибок БД
+        session.rollback()
+        return f"Error: {e}", None
 
-    if order: #Если заказ найден выполняется обновление данных
-        current_update_at  = order.updated_at # Сохранение времени изменения для оптимистической блокировки данных
+    if order is None:
+        #Дополнительный запрос только при неудаче: заказ изменен другим запросом или не существует
+        if expected_version is not None and get_order_version(session, id_order) is not None:
+            return "Version conflict", None
+        return "The order is not missing", None
+
+    return "Success", order
+    
 
-        order.status = new_status
 
-        try:  # Обработка исключений
-            if current_update_at == order.updated_at: #Проверка изменения данных
-                session.commit()
-                return "Success"
-            else:
-                return "Integrity error"
-        except Exception as e:  # Обработка всех исключений
-            session.rollback()
-            return f"Error: {e}"
 
+def update_orders_status(session: Session, new_status: OrderStatus, ids: Optional[List[int]] = None, filters: Optional[OrderFilter] = None) -> tuple[str, List[int]]:
+    """
+    Обновляет статус группы заказов одним UPDATE ... RETURNING id.
+    Заказы выбираются по списку ID или по условиям отбора.
+    Время изменения берется на стороне БД (now()), версия каждого заказа увеличивается.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param new_status: Новый статус заказов.
+    :param ids: Список ID заказов. Если None, используются filters.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Строка с информацией о результате работы функции и список ID измененных заказов.
+    """
+    query = (
+        update(Order)
+        .values(status=new_status, version=Order.version + 1, updated_at=utcnow())
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    )
+    if ids is not None:
+        query = query.where(Order.id.in_(ids))
     else:
-        return "The product is not missing"
-    
+        query = filter_orders(query, filters)
+
+    try:  # Обработка исключений
+        updated_ids = list(session.execute(query).scalars())
+        session.commit()
+    except SQLAlchemyError as e:  # Обработка ошибок БД
+        session.rollback()
+        return f"Error: {e}", []
+
+    return "Success", updated_ids
+
+
+#Отчеты по продажам. Выручка считается по текущей цене товара, так как в OrderItem цена не сохраняется
+SALES_DAY = func.date(Order.date, type_=Date)
+SALES_QUANTITY = func.sum(OrderItem.quantity)
+SALES_REVENUE = func.sum(OrderItem.quantity * Product.price)
+#Запас при пересчете сводки: заказы, зафиксированные позже чтения сводки с меньшим updated_at, тоже попадают в пересчет
+SUMMARY_REFRESH_OVERLAP = timedelta(minutes=5)
+
+
+def mark_sales_days_dirty(session: Session, id_product: Integer, *conditions) -> None:
+    """
+    Отмечает для пересчета сводки DailySales дни всех заказов с продуктом одним INSERT ... SELECT.
+    Используется при изменениях, которые не меняют orders.updated_at. Отметки фиксируются вместе с изменением.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param id_product: ID продукта.
+    :param conditions: Дополнительные условия, при которых дни отмечаются.
+    """
+    session.execute(insert(DailySalesDirtyDay).from_select(
+        ["day"],
+        select(SALES_DAY).select_from(OrderItem).join(Order, Order.id == OrderItem.order_id)
+        .where(OrderItem.product_id == id_product, *conditions).distinct()
+    ))
+
+
+def filter_daily_sales(query, filters: Optional[OrderFilter]):
+    """
+    Добавляет к запросу по сводке DailySales условия по статусу и периоду.
+    Сводка хранит данные по дням, поэтому границы периода округляются до дня.
+
+    :param query: Select по таблице DailySales.
+    :param filters: Условия отбора или None.
+    :return: Запрос с условиями.
+    """
+    if filters is None:
+        return query
+    if filters.status is not None:
+        query = query.where(DailySales.status == filters.status)
+    if filters.date_from is not None:
+        query = query.where(DailySales.day >= filters.date_from.date())
+    if filters.date_to is not None:
+        query = query.where(DailySales.day < filters.date_to.date() + timedelta(days=1 if filters.date_to.time() != datetime.min.time() else 0))
+    return query
+
+
+def get_top_products(session: Session, limit: int, filters: Optional[OrderFilter] = None, use_summary: bool = False) -> List[Row]:
+    """
+    Товары с наибольшим количеством проданных единиц за период (GROUP BY по товару).
+
+    :param session: Объект сессии SQLAlchemy.
+    :param limit: Количество товаров в отчете.
+    :param filters: Условия отбора заказов по статусу и дате.
+    :param use_summary: True для расчета по сводке DailySales вместо orders и order_items.
+    :return: Список строк (product_id, name, quantity, revenue) по убыванию количества.
+    """
+    if use_summary:
+        quantity = func.sum(DailySales.quantity).label("quantity")
+        query = filter_daily_sales(
+            select(DailySales.product_id, Product.name, quantity, func.sum(DailySales.revenue).label("revenue"))
+            .join(Product, Product.id == DailySales.product_id),
+            filters
+        ).group_by(DailySales.product_id, Product.name)
+    else:
+        quantity = SALES_QUANTITY.label("quantity")
+        query = filter_orders(
+            select(OrderItem.product_id, Product.name, quantity, SALES_REVENUE.label("revenue"))
+            .join(Order, Order.id == OrderItem.order_id)
+            .join(Product, Product.id == OrderItem.product_id),
+            filters
+        ).group_by(OrderItem.product_id, Product.name)
+    query = query.order_by(quantity.desc(), query.selected_columns.product_id).limit(limit)
+    return session.execute(query).all()
+
+
+def get_revenue_by_day(session: Session, filters: Optional[OrderFilter] = None, use_summary: bool = False) -> List[Row]:
+    """
+    Количество проданных единиц и выручка по дням и статусам заказов (GROUP BY по дню и статусу).
+
+    :param session: Объект сессии SQLAlchemy.
+    :param filters: Условия отбора заказов по статусу и дате.
+    :param use_summary: True для расчета по сводке DailySales вместо orders и order_items.
+    :return: Список строк (day, status, quantity, revenue) по возрастанию дня.
+    """
+    if use_summary:
+        query = filter_daily_sales(
+            select(DailySales.day, DailySales.status, func.sum(DailySales.quantity).label("quantity"), func.sum(DailySales.revenue).label("revenue")),
+            filters
+        ).group_by(DailySales.day, DailySales.status).order_by(DailySales.day, DailySales.status)
+    else:
+        day = SALES_DAY.label("day")
+        query = filter_orders(
+            select(day, Order.status, SALES_QUANTITY.label("quantity"), SALES_REVENUE.label("revenue"))
+            .select_from(OrderItem)
+            .join(Order, Order.id == OrderItem.order_id)
+            .join(Product, Product.id == OrderItem.product_id),
+            filters
+        ).group_by(day, Order.status).order_by(day, Order.status)
+    return session.execute(query).all()
+
+
+def get_low_stock_products(session: Session, threshold: int, limit: Optional[int] = None) -> List[Row]:
+    """
+    Продукты каталога с остатком меньше порога, по возрастанию остатка.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param threshold: Порог остатка на складе.
+    :param limit: Максимальное количество продуктов. None для всех продуктов.
+    :return: Список строк с колонками PRODUCT_COLUMNS.
+    """
+    query = (
+        select(*PRODUCT_COLUMNS)
+        .where(Product.total_stock < threshold, Product.archived_at.is_(None))
+        .order_by(Product.total_stock, Product.id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return session.execute(query).all()
+
 
+def refresh_daily_sales(session: Session) -> int:
+    """
+    Инкрементальный пересчет сводки DailySales.
+    Пересчитываются только дни, в которых есть заказы, измененные после предыдущего пересчета
+    (с запасом SUMMARY_REFRESH_OVERLAP), и дни, отмеченные в DailySalesDirtyDay.
+    Строки этих дней удаляются и заново вставляются одним INSERT ... SELECT с GROUP BY.
+    При первом запуске сводка строится целиком.
+
+    :param session: Объект сессии SQLAlchemy.
+    :return: Количество пересчитанных дней или -1 если произошла ошибка.
+    """
+    try:
+        watermark = session.execute(select(func.max(DailySales.source_updated_at))).scalar()
+        dirty_id = session.execute(select(func.max(DailySalesDirtyDay.id))).scalar()
+        query = (
+            select(SALES_DAY, Order.status, OrderItem.product_id, SALES_QUANTITY, SALES_REVENUE, func.max(Order.updated_at))
+            .select_from(OrderItem)
+            .join(Order, Order.id == OrderItem.order_id)
+            .join(Product, Product.id == OrderItem.product_id)
+            .group_by(SALES_DAY, Order.status, OrderItem.product_id)
+        )
+
+        if watermark is None:
+            days_count = session.execute(select(func.count(SALES_DAY.distinct()))).scalar()
+            session.execute(delete(DailySales))
+        else:
+            changed_days = list(session.execute(
+                select(SALES_DAY).where(Order.updated_at >= watermark - SUMMARY_REFRESH_OVERLAP)
+                .union(select(DailySalesDirtyDay.day).where(DailySalesDirtyDay.id <= (dirty_id or 0)))
+            ).scalars())
+            days_count = len(changed_days)
+            if not changed_days:
+                return 0
+            session.execute(delete(DailySales).where(DailySales.day.in_(changed_days)))
+            query = query.where(SALES_DAY.in_(changed_days))
+
+        session.execute(insert(DailySales).from_select(
+            ["day", "status", "product_id", "quantity", "revenue", "source_updated_at"], query
+        ))
+        if dirty_id is not None:
+            #Удаляются только обработанные отметки, добавленные позже остаются до следующего пересчета
+            session.execute(delete(DailySalesDirtyDay).where(DailySalesDirtyDay.id <= dirty_id))
+        session.commit()
+        return days_count
+    except SQLAlchemyError as e:
+        session.rollback()
+        return -1
 
 
 #def create_new_order_item(session: Session, order_id_: Integer, product_id_: Integer, quantity_: Integer) -> Integer:
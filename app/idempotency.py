@@ -0,0 +1,89 @@
+from sqlalchemy import Row, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Optional
+from app.models import IdempotencyKey
+import logging
+
+#Ключи идемпотентности (заголовок Idempotency-Key).
+#Первый запрос с ключом занимает строку в таблице idempotency_keys, выполняется и сохраняет ответ.
+#Повтор с тем же ключом и телом получает сохраненный ответ без повторного выполнения запроса.
+#Ключ без сохраненного ответа не занимается заново до истечения ttl: запрос мог зафиксировать изменения
+#(например, создать заказ) до падения процесса или ошибки сохранения ответа, и повтор создал бы дубликат.
+
+logger = logging.getLogger("app.idempotency")
+
+
+def claim_idempotency_key(session: Session, scope: str, key: str, request_hash: str, ttl: float) -> Optional[Row]:
+    """
+    Занимает ключ идемпотентности одним INSERT.
+    Если ключ уже занят, возвращается сохраненная запись, в том числе без ответа (запрос выполняется или был прерван).
+    Устаревшая запись (старше ttl) удаляется, и ключ занимается заново.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param scope: Метод и путь запроса.
+    :param key: Значение заголовка Idempotency-Key.
+    :param request_hash: Хэш тела запроса.
+    :param ttl: Время хранения ответа в секундах.
+    :return: None, если ключ занят этим запросом, иначе строка (request_hash, status_code, response_body).
+    """
+    for _ in range(2):
+        now = datetime.now()
+        try:
+            session.execute(insert(IdempotencyKey).values(scope=scope, key=key, request_hash=request_hash, created_at=now))
+            session.commit()
+            return None
+        except IntegrityError:
+            session.rollback()
+
+        stored = session.execute(
+            select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response_body, IdempotencyKey.created_at)
+            .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+        ).first()
+        if stored is None:
+            continue #Запись удалена параллельным запросом
+        if stored.created_at >= now - timedelta(seconds=ttl):
+            return stored
+        session.execute(delete(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.created_at == stored.created_at))
+        session.commit()
+    return stored
+
+
+def save_idempotent_response(session: Session, scope: str, key: str, status_code: int, response_body: bytes) -> None:
+    """
+    Сохранение ответа для занятого ключа идемпотентности.
+    При ошибке БД ключ остается без ответа, и повторы получают 409 до истечения ttl, а не выполняют запрос повторно.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param scope: Метод и путь запроса.
+    :param key: Значение заголовка Idempotency-Key.
+    :param status_code: Код ответа.
+    :param response_body: Тело ответа.
+    """
+    try:
+        session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+            .values(status_code=status_code, response_body=response_body)
+        )
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        logger.exception("Failed to save response for Idempotency-Key %s %s", scope, key)
+
+
+def release_idempotency_key(session: Session, scope: str, key: str) -> None:
+    """
+    Освобождение ключа, если запрос завершился ошибкой сервера до фиксации изменений, чтобы клиент мог повторить его.
+
+    :param session: Объект сессии SQLAlchemy.
+    :param scope: Метод и путь запроса.
+    :param key: Значение заголовка Idempotency-Key.
+    """
+    try:
+        session.execute(delete(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key))
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+
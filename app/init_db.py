@@ -0,0 +1,53 @@
+from sqlalchemy import Connection, Engine, inspect, text
+from typing import Optional
+from app import models
+from app.get_session_maker import get_engine_db
+
+#Создание структуры БД. Выполняется отдельной командой перед запуском приложения:
+#    python -m app.init_db
+#Приложение при импорте и запуске к БД не подключается и таблицы не создает.
+#Команда также обновляет БД, созданную прежней версией приложения: добавляет недостающие колонки и индексы.
+
+def add_missing_columns(connection: Connection) -> None:
+    """
+    Добавление в существующие таблицы колонок модели, которых нет в БД (ALTER TABLE ... ADD COLUMN).
+    Существующие строки получают значение server_default колонки, поэтому новая колонка NOT NULL должна его иметь.
+
+    :param connection: Соединение с БД в открытой транзакции.
+    """
+    inspector = inspect(connection)
+    compiler = connection.dialect.ddl_compiler(connection.dialect, None)
+    for table in models.Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                connection.execute(text(
+                    f"ALTER TABLE {compiler.preparer.format_table(table)} ADD COLUMN {compiler.get_column_specification(column)}"
+                ))
+
+
+def init_db(engine: Optional[Engine] = None) -> None:
+    """
+    Создание всех таблиц, недостающих колонок и индексов.
+    create_all не изменяет уже существующие таблицы, поэтому недостающие колонки и индексы создаются отдельно.
+
+    :param engine: Engine БД. Если не передан, создается временный Engine по настройкам приложения.
+    """
+    own_engine = engine is None
+    if own_engine:
+        engine = get_engine_db()
+    try:
+        # Создание всех таблиц
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            add_missing_columns(connection)
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+    finally:
+        if own_engine:
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    init_db()
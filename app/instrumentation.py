@@ -0,0 +1,128 @@
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Dict, List, Optional
+from sqlalchemy import Engine, event
+from prometheus_client import Histogram
+import logging
+
+#Инструментирование запросов к БД и HTTP запросов.
+#Статистика текущего HTTP запроса хранится в ContextVar: SQLAlchemy передает контекст в greenlet,
+#в котором выполняются запросы AsyncSession, поэтому обработчики событий Engine видят статистику своего запроса.
+
+logger = logging.getLogger("app.sql")
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP запроса", ["method", "route", "status"]
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Количество запросов к БД за один HTTP запрос", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+)
+HTTP_REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Суммарное время запросов к БД за один HTTP запрос", ["method", "route"]
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Время выполнения одного запроса к БД"
+)
+
+
+@dataclass
+class RequestStats:
+    """
+    Статистика запросов к БД в рамках одного HTTP запроса.
+    """
+    query_count: int = 0
+    db_time: float = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+#Список запросов к БД профилируемого HTTP запроса. None, если запрос не профилируется
+_captured_statements: ContextVar[Optional[List[Dict]]] = ContextVar("captured_statements", default=None)
+
+
+def start_sql_capture() -> tuple[List[Dict], Token]:
+    """
+    Включение записи текста и времени запросов к БД для текущего контекста (профилируемого HTTP запроса).
+
+    :return: Список, в который записываются запросы, и токен для stop_sql_capture.
+    """
+    statements: List[Dict] = []
+    return statements, _captured_statements.set(statements)
+
+
+def stop_sql_capture(token: Token) -> None:
+    """
+    Отключение записи запросов к БД.
+
+    :param token: Токен из start_sql_capture.
+    """
+    _captured_statements.reset(token)
+
+
+def instrument_engine(engine: Engine, slow_query_threshold_ms: Optional[float] = None) -> None:
+    """
+    Подключает к Engine обработчики before_cursor_execute/after_cursor_execute,
+    которые измеряют время каждого запроса и пишут в лог медленные запросы.
+    Для AsyncEngine передается engine.sync_engine.
+
+    :param engine: Синхронный Engine.
+    :param slow_query_threshold_ms: Порог медленного запроса в миллисекундах. None отключает лог.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_DURATION.observe(elapsed)
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.query_count += 1
+            stats.db_time += elapsed
+
+        statements = _captured_statements.get()
+        if statements is not None:
+            statements.append({"statement": statement, "executemany": executemany, "duration_ms": round(elapsed * 1000, 3)})
+
+        if slow_query_threshold_ms is not None and elapsed * 1000 >= slow_query_threshold_ms:
+            logger.warning("Slow query %.1f ms: %s", elapsed * 1000, statement)
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware, которое для каждого HTTP запроса записывает время обработки,
+    количество запросов к БД и их суммарное время в гистограммы Prometheus с меткой шаблона пути.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter() - started
+            _request_stats.reset(token)
+            #Шаблон пути ("/products/{product_id}") появляется в scope после выбора маршрута
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.labels(method, route, str(status["code"])).observe(elapsed)
+            HTTP_REQUEST_DB_QUERIES.labels(method, route).observe(stats.query_count)
+            HTTP_REQUEST_DB_DURATION.labels(method, route).observe(stats.db_time)
@@ -1,157 +1,801 @@
-from fastapi import FastAPI, HTTPException
-from app.functions_for_BD import create_new_product, create_new_order,  get_products, get_orders, get_product_by_id, get_order_by_id, delete_product, update_product_info, update_order_status
-from typing import List
-from app.get_session_maker import get_session_maker
-from app.schemas import ProductResponse, ProductRequest, OrderResponse, OrderRequest, ProductInOrderRequest, OrderStatusRequest
-from app import models
-from app.get_session_maker import get_engine_db
+from fastapi import FastAPI, HTTPException, Path, Query, Request, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, Response, ORJSONResponse, FileResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from app.async_functions_for_BD import create_new_product, create_products_bulk, create_new_order,  get_product_rows, get_order_rows, get_products_version, get_orders_version, get_product_version, get_order_version, stream_products, stream_orders, get_product_response, get_product_responses, get_order_by_id, get_order_detail, delete_product, archive_product, set_stock_shards, update_product_info, update_order_status, update_orders_status, get_top_products, get_revenue_by_day, get_low_stock_products, refresh_daily_sales, get_changes, stream_order_export, claim_idempotency_key, save_idempotent_response, release_idempotency_key
+from typing import Annotated, Any, AsyncIterator, Awaitable, Callable, List, Literal, Optional
+from app.get_session_maker import get_async_engine_db, get_async_session_maker, settings
+from app.schemas import ProductResponse, ProductRequest, OrderResponse, OrderRequest, ProductInOrderRequest, OrderStatusRequest, ProductBulkResponse, OrderFilter, OrderStatusBulkRequest, OrderStatusBulkResponse, TopProductResponse, RevenueResponse, ProductsByIdsRequest, ProductsByIdsResponse
+from pydantic import TypeAdapter, ValidationError
+from app.cache import product_cache
+from app.pool_metrics import pool_status
+from app.instrumentation import InstrumentationMiddleware
+from app.profiling import ProfileStore, ProfilingMiddleware, profiling_enabled
+from app.order_ingestion import OrderBatcher
+from app.replicas import ReplicaRouter, ReadYourWritesMiddleware, reads_from_primary
+from app.functions_for_BD import EXPORT_FIELDS
+from app.models import INT4_MIN, INT4_MAX
+from app.etag import make_etag, version_etag, if_match_version, etag_matches, not_modified
 import uvicorn
+import asyncio
+import csv
+import io
+import json
+import orjson
+import enum
+import logging
+import zlib
+from datetime import datetime
+from time import monotonic
+from hashlib import sha256
 
-#Запуск БД
-#Создание объекта Engine
-engine = get_engine_db()
-# Создание всех таблиц и обработчиков
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger("app.main")
 
-app = FastAPI()
+#Фабрика асинхронных сессий для эндпоинтов. Engine создается и привязывается при запуске приложения (lifespan),
+#поэтому импорт приложения не подключается к БД. Структура БД создается командой python -m app.init_db
+AsyncSessionLocal = get_async_session_maker()
+async_engine: Optional[AsyncEngine] = None
+#Маршрутизация чтения на реплики. None, если реплики не заданы в настройках
+replica_router: Optional[ReplicaRouter] = None
+#Прием заказов пачками. None, если в настройках order_batch_size меньше 2
+order_batcher: Optional[OrderBatcher] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Жизненный цикл приложения. При запуске создается один асинхронный Engine на процесс,
+    Engine реплик с фоновой проверкой их исправности и очередь приема заказов пачками.
+    При остановке создаются заказы из очереди и закрываются все соединения асинхронных пулов.
+    """
+    global async_engine, replica_router, order_batcher
+    async_engine = get_async_engine_db()
+    AsyncSessionLocal.configure(bind=async_engine)
+    health_checks = None
+    if settings.replica_urls:
+        replica_router = ReplicaRouter(
+            async_engine, [get_async_engine_db(url) for url in settings.replica_urls],
+            settings.replica_check_interval, settings.replica_check_timeout
+        )
+        await replica_router.check_replicas() #Реплики используются для чтения только после успешной проверки
+        health_checks = asyncio.create_task(replica_router.run_health_checks())
+    if settings.order_batch_size > 1:
+        order_batcher = OrderBatcher(AsyncSessionLocal, settings.order_batch_size, settings.order_batch_max_wait_ms / 1000)
+        order_batcher.start()
+    yield
+    if order_batcher is not None:
+        await order_batcher.close()
+        order_batcher = None
+    if replica_router is not None:
+        health_checks.cancel()
+        await replica_router.dispose()
+        replica_router = None
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+#Метрики количества и времени запросов к БД по каждому эндпоинту
+app.add_middleware(InstrumentationMiddleware)
+if settings.replica_urls:
+    #Окно чтения из основной БД после изменения данных клиентом
+    app.add_middleware(ReadYourWritesMiddleware, window=settings.read_your_writes_window)
+#Профили запросов с заголовком X-Profile-Token или случайной выборки.
+#Middleware подключается последним, чтобы профиль включал все остальные middleware
+profile_store = ProfileStore(settings.profile_dir, settings.profile_max_count)
+if profiling_enabled(settings.profile_token, settings.profile_sample_rate):
+    app.add_middleware(
+        ProfilingMiddleware, store=profile_store, token=settings.profile_token,
+        sample_rate=settings.profile_sample_rate, interval=settings.profile_interval
+    )
+
+
+def read_session(request: Request) -> AsyncSession:
+    """
+    Сессия для эндпоинтов чтения. Если заданы реплики, сессия привязывается к следующей исправной реплике.
+    В окне read-your-writes (после изменения данных клиентом) сессия привязывается к основной БД.
+
+    :param request: Текущий запрос.
+    :return: Асинхронная сессия, еще не открытая (используется в async with).
+    """
+    if replica_router is None or reads_from_primary(request.headers.get("cookie")):
+        return AsyncSessionLocal()
+    return AsyncSessionLocal(bind=replica_router.read_engine())
+
+def product_cache_options(request: Request) -> dict:
+    """
+    Параметры кэша продуктов (read_cache, fill_cache) для чтения в сессии read_session.
+    Кэш общий для всех запросов процесса, поэтому заполняется только чтением из основной БД:
+    продукт из отстающей реплики остался бы в кэше после его изменения.
+    В окне read-your-writes кэш не читается, так как изменение клиента могло пройти через другой процесс с другим кэшем.
+
+    :param request: Текущий запрос.
+    :return: Именованные аргументы для get_product_response и get_product_responses.
+    """
+    if replica_router is None:
+        return {}
+    if reads_from_primary(request.headers.get("cookie")):
+        return {"read_cache": False}
+    return {"fill_cache": False}
+
+#Максимальный размер страницы для пагинации списков
+MAX_PAGE_SIZE = 1000
+#Проверка списка товаров при массовом импорте
+PRODUCTS_ADAPTER = TypeAdapter(List[ProductRequest])
+#Сериализация списков продуктов и заказов из кортежей колонок
+PRODUCT_LIST_ADAPTER = TypeAdapter(List[ProductResponse])
+ORDER_LIST_ADAPTER = TypeAdapter(List[OrderResponse])
+TOP_PRODUCTS_ADAPTER = TypeAdapter(List[TopProductResponse])
+REVENUE_ADAPTER = TypeAdapter(List[RevenueResponse])
+#ID записи в параметрах пути. ID вне диапазона колонки Integer отклоняются с 422 до запроса к БД
+IdPath = Annotated[int, Path(ge=INT4_MIN, le=INT4_MAX)]
+#Максимальное количество частей остатка популярного товара
+MAX_STOCK_SHARDS = 64
+#Количество строк, которое читается из БД и отправляется клиенту за один раз при потоковой выдаче
+STREAM_CHUNK_SIZE = 1000
+
+def serialize_rows(adapter: TypeAdapter, rows) -> list:
+    """
+    Быстрая сериализация списка строк из БД.
+    Строки (кортежи колонок) проверяются одним вызовом TypeAdapter и превращаются в словари,
+    которые затем выводятся в JSON через orjson, без jsonable_encoder и ORM объектов.
+
+    :param adapter: TypeAdapter списка схем ответа.
+    :param rows: Строки из БД.
+    :return: Список словарей для orjson.
+    """
+    return adapter.dump_python(adapter.validate_python(rows))
+
+
+async def stream_ndjson(session: AsyncSession, stream_rows, adapter: TypeAdapter, after: Optional[int], **filters) -> AsyncIterator[bytes]:
+    """
+    Генератор потоковой выдачи в формате NDJSON.
+    Сессия открывается внутри генератора и живет, пока клиент читает ответ.
+    Строки сериализуются и отправляются порциями, поэтому память не зависит от размера таблицы.
+
+    :param session: Неоткрытая асинхронная сессия, которая открывается в генераторе.
+    :param stream_rows: Функция потокового чтения (stream_products или stream_orders).
+    :param adapter: TypeAdapter списка схем ответа.
+    :param after: ID, после которого начинается выдача.
+    :param filters: Дополнительные условия отбора для функции потокового чтения.
+    :return: Асинхронный итератор байтовых порций ответа.
+    """
+    async with session:
+        async for rows in stream_rows(session, after, STREAM_CHUNK_SIZE, **filters):
+            yield b"".join(orjson.dumps(item) + b"\n" for item in serialize_rows(adapter, rows))
+
+async def products_by_ids(request: Request, ids: List[int]) -> ProductsByIdsResponse:
+    """
+    Получение продуктов по списку ID за один запрос к БД (продукты из кэша не запрашиваются).
+    Повторяющиеся ID учитываются один раз, порядок ответа совпадает с порядком запроса.
+    ID вне диапазона колонки Integer сразу попадают в missing без запроса к БД.
+
+    :param request: Текущий запрос.
+    :param ids: Список ID продуктов.
+    :return: Найденные продукты и ID ненайденных.
+    """
+    if len(ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=422, detail=f"Не больше {MAX_PAGE_SIZE} ID в запросе")
+    ids = list(dict.fromkeys(ids))
+    async with read_session(request) as session:
+        products = await get_product_responses(session, [id_product for id_product in ids if INT4_MIN <= id_product <= INT4_MAX], **product_cache_options(request))
+    return ProductsByIdsResponse(
+        items=[products[id_product] for id_product in ids if id_product in products],
+        missing=[id_product for id_product in ids if id_product not in products]
+    )
 
-#Создание фабрики сессий
-SessionLocal = get_session_maker()
 
 @app.get("/products")
-async def send_products():
+async def send_products(request: Request, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), after: Optional[int] = Query(None, ge=INT4_MIN, le=INT4_MAX), format: Optional[str] = Query(None, pattern="^ndjson$"), ids: Optional[str] = Query(None, pattern=r"^\d+(,\d+)*$")):
     """
-    Запрос для получения списка всех продуктов.
-    Ответ: 200 ОК Список продуктов или сообщение "Нет товаров"
+    Запрос для получения списка продуктов.
+    Без параметров возвращает все продукты.
+    ids=1,2,3 возвращает продукты по списку ID одним запросом к БД в порядке списка и ненайденные ID (missing).
+    limit и after включают пагинацию по ключу: возвращается не более limit продуктов с id > after и next_after для следующей страницы.
+    format=ndjson включает потоковую выдачу: продукты передаются по одному JSON в строке по мере чтения из БД.
+    Ответ (кроме потока NDJSON) содержит ETag списка или страницы. Если он совпадает с If-None-Match, возвращается 304 без чтения продуктов.
+    Ответ: 200 ОК Список продуктов, страница продуктов, поток NDJSON, продукты по списку ID или сообщение "Нет товаров", 304 если список не изменился
     """
-    with SessionLocal() as session:
-        products_list = get_products(session) #Получение списка продуктов
+    if ids is not None:
+        return ORJSONResponse((await products_by_ids(request, [int(id_product) for id_product in ids.split(",")])).model_dump())
+
+    if format == "ndjson":
+        #Поток без ETag: версия списка потребовала бы отдельного чтения всей таблицы перед выдачей
+        return StreamingResponse(stream_ndjson(read_session(request), stream_products, PRODUCT_LIST_ADAPTER, after), media_type="application/x-ndjson")
 
-        if len(products_list) == 0:
-            return {"message":"Товаров нет"}
+    async with read_session(request) as session:
+        etag = make_etag("products", *await get_products_version(session, limit, after), request.url.query) #Версия списка или страницы одним агрегирующим запросом
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag)
+
+        products_list = await get_product_rows(session, limit, after) #Получение списка или страницы продуктов
+
+        if limit is not None:
+            return ORJSONResponse({
+                "items": serialize_rows(PRODUCT_LIST_ADAPTER, products_list),
+                "next_after": products_list[-1].id if len(products_list) == limit else None
+            }, headers={"ETag": etag})
+        elif len(products_list) == 0:
+            return ORJSONResponse({"message":"Товаров нет"}, headers={"ETag": etag})
         else:
-            return products_list
+            return ORJSONResponse(serialize_rows(PRODUCT_LIST_ADAPTER, products_list), headers={"ETag": etag})
 
 @app.get("/orders")
-async def send_orders():
+async def send_orders(request: Request, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), after: Optional[int] = Query(None, ge=INT4_MIN, le=INT4_MAX), format: Optional[str] = Query(None, pattern="^ndjson$"), filters: OrderFilter = Depends()):
     """
-    Запрос для получения списка всех заказов.
-    Ответ: 200 ОК Список заказов или сообщение "Заказов нет"
+    Запрос для получения списка заказов.
+    Без параметров возвращает все заказы.
+    status, date_from и date_to отбирают заказы по статусу и периоду даты заказа [date_from, date_to).
+    limit и after включают пагинацию по ключу: возвращается не более limit заказов с id > after и next_after для следующей страницы.
+    format=ndjson включает потоковую выдачу заказов по одному JSON в строке.
+    Ответ (кроме потока NDJSON) содержит ETag списка или страницы. Если он совпадает с If-None-Match, возвращается 304 без чтения заказов.
+    Ответ: 200 ОК Список заказов, страница заказов, поток NDJSON или сообщение "Заказов нет", 304 если список не изменился
     """
-    with SessionLocal() as session:
-        orders_list = get_orders(session) #Получение списка заказов
+    if format == "ndjson":
+        #Поток без ETag: версия списка потребовала бы отдельного чтения всей таблицы перед выдачей
+        return StreamingResponse(stream_ndjson(read_session(request), stream_orders, ORDER_LIST_ADAPTER, after, filters=filters), media_type="application/x-ndjson")
+
+    async with read_session(request) as session:
+        etag = make_etag("orders", *await get_orders_version(session, filters, limit, after), request.url.query) #Версия списка или страницы с учетом условий отбора
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag)
 
-        if len(orders_list) == 0:
-            return {"message":"Заказов нет"}
+        orders_list = await get_order_rows(session, limit, after, filters) #Получение списка или страницы заказов
+
+        if limit is not None:
+            return ORJSONResponse({
+                "items": serialize_rows(ORDER_LIST_ADAPTER, orders_list),
+                "next_after": orders_list[-1].id if len(orders_list) == limit else None
+            }, headers={"ETag": etag})
+        elif len(orders_list) == 0:
+            return ORJSONResponse({"message":"Заказов нет"}, headers={"ETag": etag})
         else:
-            return orders_list
+            return ORJSONResponse(serialize_rows(ORDER_LIST_ADAPTER, orders_list), headers={"ETag": etag})
 
 @app.get("/products/{product_id}")
-async def send_product(product_id: int):
+async def send_product(product_id: IdPath, request: Request, response: Response):
     """
     Запрос для получения продукта по ID.
     ID передается в параметрах пути.
-    Ответ: 200 ОК продукт или сообщение "Продукт не найден"
+    Ответ содержит ETag продукта (ID и номер версии). Если он совпадает с If-None-Match, возвращается 304 после чтения только версии.
+    Ответ: 200 ОК продукт или сообщение "Продукт не найден", 304 если продукт не изменился
     """
-    with SessionLocal() as session:
-        product = get_product_by_id(session, product_id) #Получение продукта 
+    async with read_session(request) as session:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            version = await get_product_version(session, product_id) #Легкий запрос версии продукта
+            etag = version_etag(product_id, version)
+            if version is not None and etag_matches(if_none_match, etag):
+                return not_modified(etag)
+
+        product = await get_product_response(session, product_id, **product_cache_options(request)) #Получение продукта через кэш
 
         if product == None:
             return {"message" : "Продукт не найден"}
         else: 
+            response.headers["ETag"] = version_etag(product.id, product.version)
             return product
     
+def order_etag(id_order: int, version: int, products_updated_at: Optional[datetime], items_count: Optional[int] = None) -> str:
+    """
+    ETag заказа. Без позиций это ETag версии заказа, который принимает If-Match.
+    С позициями (expand=items) в ETag учитываются последнее изменение товаров заказа и количество позиций.
+    """
+    if products_updated_at is None:
+        return version_etag(id_order, version)
+    return make_etag("order", id_order, version, products_updated_at, items_count)
+
 @app.get("/orders/{order_id}")
-async def send_order(order_id: int):
+async def send_order(order_id: IdPath, request: Request, response: Response, expand: Optional[str] = Query(None, pattern="^items$")):
     """
     Запрос для получения заказа по ID.
     ID передается в параметрах пути.
-    Ответ: 200 ОК заказ или сообщение "Заказ не найден"
+    expand=items добавляет в ответ позиции заказа с товарами, стоимость позиций и заказа.
+    Ответ содержит ETag заказа (ID и номер версии, с expand=items учитываются и изменения товаров и позиций заказа).
+    Если он совпадает с If-None-Match, возвращается 304 после чтения только версии.
+    Ответ: 200 ОК заказ или сообщение "Заказ не найден", 304 если заказ не изменился
     """
-    with SessionLocal() as session:
-        order = get_order_by_id(session, order_id) #Получение заказа 
+    async with read_session(request) as session:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            version = await get_order_version(session, order_id, expand == "items") #Легкий запрос версии заказа
+            if version is not None:
+                etag = order_etag(order_id, *version)
+                if etag_matches(if_none_match, etag):
+                    return not_modified(etag)
+
+        if expand == "items":
+            order = await get_order_detail(session, order_id) #Получение заказа с позициями
+            products_updated_at = max((item.product.updated_at for item in order.items), default=None) if order else None
+            items_count = len(order.items) if order else None
+        else:
+            order = await get_order_by_id(session, order_id) #Получение заказа 
+            products_updated_at = items_count = None
 
         if order == None:
             return {"message" : "Заказ не найден"}
         else: 
+            response.headers["ETag"] = order_etag(order.id, order.version, products_updated_at, items_count)
             return order
     
+async def run_idempotent(request: Request, payload: Any, handler: Callable[[], Awaitable[Any]]):
+    """
+    Выполнение изменяющего запроса с поддержкой заголовка Idempotency-Key.
+    Без заголовка handler выполняется как обычно.
+    С заголовком ключ занимается в таблице idempotency_keys, а ответ handler сохраняется.
+    Повтор с тем же ключом и телом получает сохраненный ответ без повторного выполнения handler.
+    handler вызывает HTTPException 5xx только при ошибке БД с откатом транзакции, поэтому такие ответы не сохраняются и ключ освобождается для повтора.
+    При другом исключении handler мог уже зафиксировать изменения, поэтому ключ остается занятым без ответа
+    и повторы получают 409 до истечения idempotency_key_ttl.
+
+    :param request: Текущий запрос.
+    :param payload: Данные запроса, от которых вычисляется хэш (проверенные модели тела).
+    :param handler: Функция, выполняющая запрос и возвращающая модель ответа или вызывающая HTTPException.
+    :return: Ответ handler или сохраненный ответ.
+    """
+    key = request.headers.get("idempotency-key")
+    if key is None:
+        return await handler()
+
+    scope = f"{request.method} {request.url.path}"
+    request_hash = sha256(orjson.dumps(jsonable_encoder(payload), option=orjson.OPT_SORT_KEYS)).hexdigest()
+    async with AsyncSessionLocal() as session:
+        stored = await claim_idempotency_key(session, scope, key, request_hash, settings.idempotency_key_ttl)
+    if stored is not None:
+        if stored.request_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key уже использован с другими данными запроса")
+        if stored.status_code is None:
+            raise HTTPException(status_code=409, detail="Запрос с этим Idempotency-Key еще выполняется")
+        return Response(stored.response_body, status_code=stored.status_code, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+
+    try:
+        result = await handler()
+    except HTTPException as e:
+        async with AsyncSessionLocal() as session:
+            if e.status_code >= 500:
+                await release_idempotency_key(session, scope, key)
+            else:
+                await save_idempotent_response(session, scope, key, e.status_code, orjson.dumps({"detail": jsonable_encoder(e.detail)}))
+        raise
+    except BaseException:
+        logger.exception("Request with Idempotency-Key %s %s failed, the key stays in progress", scope, key)
+        raise
+
+    async with AsyncSessionLocal() as session:
+        await save_idempotent_response(session, scope, key, 200, orjson.dumps(jsonable_encoder(result)))
+    return result
+
+
 @app.post("/products", response_model=ProductResponse)
-async def create_product(product: ProductRequest):
+async def create_product(product: ProductRequest, request: Request):
     """
     Запрос для получения создания продукта.
     Информация о продукте передается в параметрах запроса.
+    Заголовок Idempotency-Key защищает от повторного создания при повторе запроса клиентом.
     Ответ: 200 ОК информацию о товаре или ошибку
     """
-    with SessionLocal() as session:
-        product_id = create_new_product(session, product.name, product.description, product.price, product.stock_quantity) #Создание заказа
+    async def create() -> ProductResponse:
+        async with AsyncSessionLocal() as session:
+            product_id = await create_new_product(session, product.name, product.description, product.price, product.stock_quantity) #Создание заказа
+
+            if product_id > -1:
+                return await get_product_response(session, product_id)
+            else:
+                raise HTTPException(status_code=504, detail="Ошибка базы данных")
+
+    return await run_idempotent(request, product, create)
+
+
+def parse_products_payload(body: bytes, content_type: str) -> List[ProductRequest]:
+    """
+    Разбор тела запроса массового импорта товаров.
+    Поддерживаются JSON массив (application/json), NDJSON (application/x-ndjson)
+    и CSV с заголовком name,description,price,stock_quantity (text/csv).
+
+    :param body: Тело запроса.
+    :param content_type: Значение заголовка Content-Type.
+    :return: Список проверенных ProductRequest.
+    """
+    try:
+        text = body.decode("utf-8-sig")
+        if content_type.startswith("text/csv"):
+            rows = list(csv.DictReader(io.StringIO(text)))
+        elif content_type.startswith("application/x-ndjson"):
+            rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            rows = json.loads(text)
+            if not isinstance(rows, list):
+                raise HTTPException(status_code=422, detail="Ожидается JSON массив товаров")
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(status_code=422, detail=f"Некорректные данные: {e}")
+
+    try:
+        return PRODUCTS_ADAPTER.validate_python(rows)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+
+@app.post("/products/by-ids", response_model=ProductsByIdsResponse)
+async def send_products_by_ids(products_ids: ProductsByIdsRequest, request: Request):
+    """
+    Запрос для получения продуктов по длинному списку ID, передаваемому в теле запроса.
+    Продукты читаются одним запросом к БД, порядок ответа совпадает с порядком ID.
+    Ответ: 200 ОК найденные продукты (items) и ненайденные ID (missing), 422 если ID больше MAX_PAGE_SIZE
+    """
+    return await products_by_ids(request, products_ids.ids)
+
+
+@app.post("/products/bulk", response_model=ProductBulkResponse)
+async def create_products(request: Request):
+    """
+    Запрос для массового импорта товаров.
+    Товары передаются в теле запроса как JSON массив, NDJSON или CSV (определяется по Content-Type).
+    Вставка выполняется пачками, один commit на пачку.
+    Ответ: 200 ОК список ID созданных товаров в порядке входных данных, 422 при некорректных данных или 504 при ошибке БД
+    """
+    products = parse_products_payload(await request.body(), request.headers.get("content-type", "application/json"))
+
+    async with AsyncSessionLocal() as session:
+        ids, error = await create_products_bulk(session, products, settings.bulk_insert_batch_size)
 
-        if product_id > -1:
-            return get_product_by_id(session, product_id)
+        if error is None:
+            return ProductBulkResponse(ids=ids)
         else:
-            raise HTTPException(status_code=504, detail="Ошибка базы данных")
+            raise HTTPException(status_code=504, detail={"message": "Ошибка базы данных", "inserted_ids": ids})
 
 
 @app.put("/products/{product_id}", response_model=ProductResponse)
-async def update_product(product: ProductRequest, product_id: int):
+async def update_product(product: ProductRequest, product_id: IdPath, request: Request, response: Response):
     """
     Запрос для изменения продукта.
     ID продукта передается в параметрах пути.
     Информация о продукте передается в параметрах запроса.
-    Ответ: 200 ОК информацию о товаре или ошибку
+    Заголовок If-Match с ETag продукта включает оптимистическую блокировку: продукт изменяется, только если его версия не изменилась.
+    Ответ: 200 ОК информацию о товаре или ошибку, 412 если продукт изменен другим запросом
     """
-    with SessionLocal() as session:
-        result_update = update_product_info(session, product_id, product.name, product.description, product.price, product.stock_quantity) #Изменение каждого параметра товара
+    async with AsyncSessionLocal() as session:
+        expected_version = if_match_version(request.headers.get("if-match"), product_id)
+        result_update, updated_product = await update_product_info(session, product_id, product.name, product.description, product.price, product.stock_quantity, expected_version) #Изменение продукта одним запросом
 
         if result_update == "Success":
-            return get_product_by_id(session, product_id)
+            response.headers["ETag"] = version_etag(product_id, updated_product.version)
+            return ProductResponse.model_validate(updated_product)
+        elif result_update == "Version conflict":
+            raise HTTPException(status_code=412, detail=result_update)
         else:
             raise HTTPException(status_code=404, detail=result_update)
         
+@app.put("/products/{product_id}/stock-shards", response_model=ProductResponse)
+async def update_stock_shards(product_id: IdPath, count: int = Query(ge=0, le=MAX_STOCK_SHARDS)):
+    """
+    Запрос для деления остатка популярного товара на count частей.
+    Параллельные заказы списывают остаток из разных частей и не ждут блокировки одной строки товара.
+    count=0 отключает деление. Общий остаток товара не меняется.
+    Ответ: 200 ОК информацию о товаре, 404 в случае если нет товара, 504 при ошибке БД.
+    """
+    async with AsyncSessionLocal() as session:
+        result_shards = await set_stock_shards(session, product_id, count)
+        if result_shards == -1:
+            raise HTTPException(status_code=404, detail="Item not found")
+        elif result_shards == -2:
+            raise HTTPException(status_code=504, detail="Database Error")
+        return await get_product_response(session, product_id)
+
 @app.delete("/products/{product_id}")
-async def delete_product_from_db(product_id: int):
+async def delete_product_from_db(product_id: IdPath, archive: bool = False):
     """
     Запрос для удаления продукта.
     ID продукта передается в параметрах пути.
+    archive=true архивирует продукт вместо удаления: он скрывается из каталога, а состав заказов сохраняется.
     Ответ: 200 ОК сообщение об успешном удалении продукта. 404 в случае если нет товара или произошла ошибка.
     """
-    with SessionLocal() as session:
-        result_delete = delete_product(session, product_id)#Удаление товара
+    async with AsyncSessionLocal() as session:
+        if archive:
+            result_delete = await archive_product(session, product_id)#Архивирование товара
+        else:
+            result_delete = await delete_product(session, product_id)#Удаление товара
 
         if result_delete == 0:
             raise HTTPException(status_code=404, detail="Item not found")
         elif result_delete == -1:
             raise HTTPException(status_code=504, detail="Database Error")
+        elif archive:
+            return {"message": f"Product {product_id} archived"}
         else:
             return {"message": f"Product {product_id} deleted"}
 
+@app.patch("/orders", response_model=OrderStatusBulkResponse)
+async def update_orders_status_db(orders_status: OrderStatusBulkRequest):
+    """
+    Запрос для массового обновления статуса заказов.
+    Заказы передаются списком ids или условиями отбора filter (status, date_from, date_to).
+    Статус всех заказов изменяется одним запросом к БД.
+    Ответ: 200 ОК результат по каждому ID, 422 если не переданы ни ids, ни условия отбора, 504 при ошибке БД.
+    """
+    if orders_status.ids is None and (orders_status.filter is None or not orders_status.filter.model_dump(exclude_none=True)):
+        #Пустое условие изменило бы все заказы
+        raise HTTPException(status_code=422, detail="Необходимо передать ids или условия отбора filter")
+
+    async with AsyncSessionLocal() as session:
+        result_update, updated_ids = await update_orders_status(session, orders_status.status, orders_status.ids, orders_status.filter)
+
+        if result_update != "Success":
+            raise HTTPException(status_code=504, detail=result_update)
+
+        results = {id_order: "Success" for id_order in updated_ids}
+        for id_order in orders_status.ids or []:
+            results.setdefault(id_order, "The order is not missing")
+        return OrderStatusBulkResponse(status=orders_status.status, results=results)
+
 @app.patch("/orders/{order_id}", response_model=OrderResponse)
-def update_order_status_db(status: OrderStatusRequest, order_id: int):
+async def update_order_status_db(status: OrderStatusRequest, order_id: IdPath, request: Request, response: Response):
     """
     Запрос для обновления статуса заказа.
     ID заказа передается в параметрах пути.
     Новый стату передается в параметрах запроса.
-    Ответ: 200 ОК информация о заказе, 404 в случае если нет товара или произошла ошибка.
+    Заголовок If-Match с ETag заказа включает оптимистическую блокировку: статус изменяется, только если версия заказа не изменилась.
+    Ответ: 200 ОК информация о заказе, 404 в случае если нет товара или произошла ошибка, 412 если заказ изменен другим запросом.
     """
-    with SessionLocal() as session:
-        result_update_status = update_order_status(session, order_id, status.status)
+    async with AsyncSessionLocal() as session:
+        expected_version = if_match_version(request.headers.get("if-match"), order_id)
+        result_update_status, updated_order = await update_order_status(session, order_id, status.status, expected_version) #Изменение статуса одним запросом
 
         if  result_update_status == "Success":
-            return get_order_by_id(session, order_id)
+            response.headers["ETag"] = version_etag(order_id, updated_order.version)
+            return OrderResponse.model_validate(updated_order)
+        elif result_update_status == "Version conflict":
+            raise HTTPException(status_code=412, detail=result_update_status)
         else:
             raise HTTPException(status_code=404, detail=result_update_status)
         
 @app.post("/orders", response_model=OrderResponse)
-async def create_order_db(order: OrderRequest, products: List[ProductInOrderRequest]):
+async def create_order_db(order: OrderRequest, products: List[ProductInOrderRequest], request: Request):
     """
     Запрос для создания заказа.
     Информация о заказе и продуктах в заказе передаются в параметрах запроса.
+    При заданном ORDER_BATCH_SIZE заказ создается пачкой вместе с параллельными запросами.
+    Заголовок Idempotency-Key защищает от повторного создания заказа и списания товаров при повторе запроса клиентом.
     Ответ: 200 ОК информацию о заказе, 404 в случае если нехватает продуктов или произошла ошибка.
     """
-    with SessionLocal() as session:
-        str_result_created, int_result_created, id_order = create_new_order(session, order.date, order.status, products) #Добавление заказа. Функция возвращает ID добавленного заказа
+    async def create() -> OrderResponse:
+        if order_batcher is not None:
+            #Заказ создается вместе с другими заказами пачки в одной транзакции
+            str_result_created, int_result_created, id_order = await order_batcher.submit(order.date, order.status, products)
+        async with AsyncSessionLocal() as session:
+            if order_batcher is None:
+                str_result_created, int_result_created, id_order = await create_new_order(session, order.date, order.status, products) #Добавление заказа. Функция возвращает ID добавленного заказа
 
-        if int_result_created == 0:
-            return get_order_by_id(session, id_order)
-        else:
-            raise HTTPException(status_code=404, detail=str_result_created)
+            if int_result_created == 0:
+                return OrderResponse.model_validate(await get_order_by_id(session, id_order))
+            else:
+                raise HTTPException(status_code=404, detail=str_result_created)
+
+    return await run_idempotent(request, {"order": order, "products": products}, create)
+
+
+#Время последнего обновления сводки продаж в этом процессе (monotonic)
+daily_sales_refreshed_at = float("-inf")
+
+async def refresh_daily_sales_if_stale(session) -> None:
+    """
+    Обновление сводки продаж, если с прошлого обновления прошло больше daily_sales_refresh_interval секунд.
+    Между обновлениями отчеты по сводке не учитывают последние изменения заказов.
+    """
+    global daily_sales_refreshed_at
+    if monotonic() - daily_sales_refreshed_at < settings.daily_sales_refresh_interval:
+        return
+    if await refresh_daily_sales(session) == -1:
+        raise HTTPException(status_code=504, detail="Database Error")
+    daily_sales_refreshed_at = monotonic()
+
+
+@app.get("/analytics/top-products")
+async def send_top_products(request: Request, limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE), source: str = Query("live", pattern="^(live|summary)$"), filters: OrderFilter = Depends()):
+    """
+    Отчет по товарам с наибольшим количеством проданных единиц.
+    status, date_from и date_to отбирают заказы по статусу и периоду даты заказа [date_from, date_to).
+    source=summary считает отчет по сводке продаж по дням (для больших периодов).
+    Сводка обновляется перед расчетом не чаще, чем раз в daily_sales_refresh_interval секунд.
+    Ответ: 200 ОК список товаров с количеством и выручкой, 504 при ошибке обновления сводки
+    """
+    #Сводка обновляется в основной БД, поэтому отчет по сводке читается из нее
+    async with (AsyncSessionLocal() if source == "summary" else read_session(request)) as session:
+        if source == "summary":
+            await refresh_daily_sales_if_stale(session)
+        rows = await get_top_products(session, limit, filters, source == "summary")
+        return ORJSONResponse(serialize_rows(TOP_PRODUCTS_ADAPTER, rows))
+
+
+@app.get("/analytics/revenue")
+async def send_revenue(request: Request, source: str = Query("live", pattern="^(live|summary)$"), filters: OrderFilter = Depends()):
+    """
+    Отчет по количеству проданных единиц и выручке по дням и статусам заказов.
+    status, date_from и date_to отбирают заказы по статусу и периоду даты заказа [date_from, date_to).
+    source=summary считает отчет по сводке продаж по дням, границы периода округляются до дня.
+    Сводка обновляется перед расчетом не чаще, чем раз в daily_sales_refresh_interval секунд.
+    Ответ: 200 ОК список дней со статусом, количеством и выручкой, 504 при ошибке обновления сводки
+    """
+    #Сводка обновляется в основной БД, поэтому отчет по сводке читается из нее
+    async with (AsyncSessionLocal() if source == "summary" else read_session(request)) as session:
+        if source == "summary":
+            await refresh_daily_sales_if_stale(session)
+        rows = await get_revenue_by_day(session, filters, source == "summary")
+        return ORJSONResponse(serialize_rows(REVENUE_ADAPTER, rows))
+
+
+@app.get("/analytics/low-stock")
+async def send_low_stock(request: Request, threshold: int = Query(10, ge=1), limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Отчет по товарам каталога с остатком меньше threshold.
+    Ответ: 200 ОК список товаров по возрастанию остатка
+    """
+    async with read_session(request) as session:
+        rows = await get_low_stock_products(session, threshold, limit)
+        return ORJSONResponse(serialize_rows(PRODUCT_LIST_ADAPTER, rows))
+
+
+@app.post("/internal/analytics/refresh")
+async def refresh_analytics():
+    """
+    Служебный запрос для инкрементального обновления сводки продаж по дням.
+    Может вызываться по расписанию, чтобы отчеты с source=summary не ждали пересчета.
+    Ответ: 200 ОК количество пересчитанных дней, 504 при ошибке БД
+    """
+    global daily_sales_refreshed_at
+    async with AsyncSessionLocal() as session:
+        days = await refresh_daily_sales(session)
+        if days == -1:
+            raise HTTPException(status_code=504, detail="Database Error")
+        daily_sales_refreshed_at = monotonic()
+        return {"days": days}
+
+
+@app.get("/changes/{entity}")
+async def send_changes(entity: Literal["products", "orders"], since: Optional[datetime] = None, after_id: Optional[int] = Query(None, ge=INT4_MIN, le=INT4_MAX), limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Запрос ленты изменений продуктов или заказов для синхронизации внешних систем (поисковый индекс, ERP).
+    Возвращаются записи, измененные после курсора (since, after_id), и ID удаленных записей.
+    Следующая страница запрашивается с next_since и next_after_id из ответа, пустые списки означают, что новых изменений нет.
+    Лента читается из основной БД: реплика может отставать, и изменения оказались бы позади курсора.
+    Ответ: 200 ОК changed - измененные записи, deleted - удаленные записи, next_since и next_after_id - курсор
+    """
+    adapter = PRODUCT_LIST_ADAPTER if entity == "products" else ORDER_LIST_ADAPTER
+    async with AsyncSessionLocal() as session:
+        entries, rows = await get_changes(session, entity, limit, since, after_id, settings.changes_settle_lag)
+    return ORJSONResponse({
+        "changed": serialize_rows(adapter, rows),
+        "deleted": [{"id": entry.id, "deleted_at": entry.changed_at} for entry in entries if entry.deleted],
+        "next_since": entries[-1].changed_at if entries else since,
+        "next_after_id": entries[-1].id if entries else after_id
+    })
+
+
+def export_value(value):
+    """
+    Значение ячейки CSV выгрузки: статус заказа как строка, время в формате ISO 8601.
+    """
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def stream_export(session: AsyncSession, format: str, compress: bool, filters: OrderFilter) -> AsyncIterator[bytes]:
+    """
+    Генератор потоковой выгрузки заказов с позициями в формате NDJSON или CSV.
+    Каждая порция строк из БД сразу сериализуется (и сжимается gzip) и отправляется клиенту,
+    поэтому память не зависит от количества строк выгрузки.
+
+    :param session: Неоткрытая асинхронная сессия, которая открывается в генераторе.
+    :param format: ndjson или csv.
+    :param compress: True для сжатия gzip.
+    :param filters: Условия отбора по статусу и дате заказа.
+    :return: Асинхронный итератор байтовых порций ответа.
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None #wbits с 16 - формат gzip
+    async with session:
+        if format == "csv":
+            chunk = (",".join(EXPORT_FIELDS) + "\r\n").encode()
+            yield compressor.compress(chunk) if compressor else chunk
+        async for rows in stream_order_export(session, STREAM_CHUNK_SIZE, filters):
+            if format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows([export_value(value) for value in row] for row in rows)
+                chunk = buffer.getvalue().encode()
+            else:
+                chunk = b"".join(orjson.dumps(row._asdict()) + b"\n" for row in rows)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
+
+
+@app.get("/export/orders")
+async def export_orders(request: Request, format: str = Query("ndjson", pattern="^(ndjson|csv)$"), gzip: bool = False, filters: OrderFilter = Depends()):
+    """
+    Запрос выгрузки заказов с позициями и названиями товаров (одна строка на позицию заказа).
+    Строки читаются из БД курсором на стороне сервера и передаются клиенту по мере чтения.
+    format=ndjson (по умолчанию) или format=csv, gzip=true сжимает выгрузку на лету.
+    status, date_from и date_to отбирают заказы по статусу и периоду даты заказа [date_from, date_to).
+    Ответ: 200 ОК поток строк выгрузки
+    """
+    filename = f"orders.{format}" + (".gz" if gzip else "")
+    if gzip:
+        media_type = "application/gzip"
+    else:
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_export(read_session(request), format, gzip, filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.get("/internal/cache")
+async def send_cache_stats():
+    """
+    Служебный запрос для получения счетчиков кэша товаров.
+    Ответ: 200 ОК размер кэша, количество попаданий, промахов и вытеснений
+    """
+    return product_cache.stats()
+
+
+@app.get("/internal/pool")
+async def send_pool_stats():
+    """
+    Служебный запрос для получения состояния пула соединений, который используют эндпоинты.
+    Ответ: 200 ОК выданные, свободные и сверх лимита соединения и гистограмма времени ожидания соединения
+    """
+    return pool_status(async_engine.pool)
+
+
+@app.get("/internal/replicas")
+async def send_replicas_status():
+    """
+    Служебный запрос для получения состояния реплик для чтения.
+    Ответ: 200 ОК список реплик с признаком исправности (пустой, если реплики не заданы)
+    """
+    return replica_router.status() if replica_router is not None else []
+
+
+@app.get("/internal/order-batches")
+async def send_order_batches_status():
+    """
+    Служебный запрос для получения состояния приема заказов пачками.
+    Ответ: 200 ОК размер очереди, количество пачек и заказов (null, если прием пачками отключен)
+    """
+    return order_batcher.status() if order_batcher is not None else None
+
+
+@app.get("/internal/profiles")
+async def send_profiles():
+    """
+    Служебный запрос для получения списка последних профилей запросов.
+    Ответ: 200 ОК список профилей (ID, метод, путь, статус, время обработки, количество и время запросов к БД), новые первыми
+    """
+    return profile_store.list()
+
+
+@app.get("/internal/profiles/{profile_id}")
+async def send_profile(profile_id: str, kind: str = Query("speedscope", pattern="^(speedscope|sql)$")):
+    """
+    Служебный запрос для получения файла профиля.
+    kind=speedscope - профиль для https://www.speedscope.app, kind=sql - запросы к БД с временем выполнения.
+    Ответ: 200 ОК файл профиля в формате JSON, 404 если профиль не найден
+    """
+    path = profile_store.path(profile_id, kind)
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+
+@app.get("/metrics")
+async def send_metrics():
+    """
+    Служебный запрос для сбора метрик Prometheus: время обработки запросов,
+    количество и время запросов к БД по каждому эндпоинту.
+    Ответ: 200 ОК метрики в текстовом формате Prometheus
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,13 +1,40 @@
-from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, Enum
-from sqlalchemy.orm import relationship, Mapped, mapped_column, declarative_base
+from sqlalchemy import Integer, String, Float, Date, DateTime, ForeignKey, Enum, Index, LargeBinary, func, select
+from sqlalchemy.orm import relationship, Mapped, mapped_column, declarative_base, column_property
 from sqlalchemy.ext.declarative import declarative_base
 import enum
-from datetime import datetime
-from sqlalchemy import event
+from typing import Optional
+from datetime import date, datetime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 
 # Создаём базовый класс для описания моделей
 Base = declarative_base()
 
+# Диапазон значений колонок Integer (int4 в PostgreSQL).
+# ID и номер версии вне диапазона не могут быть в БД, а asyncpg отклоняет такие параметры запроса с ошибкой
+INT4_MIN = -2**31
+INT4_MAX = 2**31 - 1
+
+# Текущее время сервера БД в UTC (без часового пояса).
+# Время записей задается БД, а не приложением, поэтому updated_at можно использовать как курсор ленты изменений
+class utcnow(FunctionElement):
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow, "postgresql")
+def postgresql_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+@compiles(utcnow, "sqlite")
+def sqlite_utcnow(element, compiler, **kw):
+    #Время в UTC с миллисекундами (CURRENT_TIMESTAMP только с секундами) в формате хранения DateTime SQLAlchemy (6 знаков дробной части),
+    #чтобы сравнение строк совпадало со сравнением времени
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
+
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
 # Структура для описания статусов заказа
 class OrderStatus(enum.Enum):
     in_progress = "в процессе"
@@ -19,8 +46,9 @@ class BaseModel(Base):
     __abstract__ = True
 
     id: Mapped[int] = mapped_column(Integer, nullable=False, unique=True, primary_key=True, autoincrement=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now())
-    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now())
+    # Время создания и изменения задается БД при каждом INSERT и UPDATE
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow(), server_default=utcnow())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
 
 # Модель Product (Товар)
 class Product(BaseModel):
@@ -30,16 +58,58 @@ class Product(BaseModel):
     description: Mapped[str] = mapped_column(String)
     price: Mapped[float] = mapped_column(Float, nullable=False)
     stock_quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Номер версии строки для оптимистической блокировки. Увеличивается при каждом изменении
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
+    # Время архивации товара. Архивный товар скрыт из каталога, но остается в истории заказов
+    archived_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    # eager_defaults: время, заданное БД, возвращается тем же INSERT/UPDATE (RETURNING)
+    __mapper_args__ = {"version_id_col": version, "eager_defaults": True}
+
+    # Индекс для ленты изменений по курсору (updated_at, id)
+    __table_args__ = (Index("ix_products_updated_at_id", "updated_at", "id"),)
 
     def __repr__(self):
         return f"<Product(id={self.id}, name={self.name}, price={self.price}), update_at={self.updated_at}>"
 
+# Модель ProductStockShard (Часть остатка товара)
+# Остаток популярного товара делится на несколько строк, чтобы параллельные заказы списывали его из разных строк
+# и не ждали блокировки одной строки products. Остаток такого товара в products.stock_quantity равен 0
+class ProductStockShard(Base):
+    __tablename__ = 'product_stock_shards'
+
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey('products.id'), primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True) # Номер части от 0
+    stock_quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Номер версии части. Увеличивается при каждом списании и входит в версию товара
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+    def __repr__(self):
+        return f"<ProductStockShard(product_id={self.product_id}, shard={self.shard}, stock_quantity={self.stock_quantity})>"
+
+# Общий остаток и версия товара с учетом частей остатка. Используются в ответах вместо stock_quantity и version
+Product.total_stock = column_property(
+    Product.stock_quantity + select(func.coalesce(func.sum(ProductStockShard.stock_quantity), 0))
+    .where(ProductStockShard.product_id == Product.id).correlate_except(ProductStockShard).scalar_subquery()
+)
+Product.total_version = column_property(
+    Product.version + select(func.coalesce(func.sum(ProductStockShard.version), 0))
+    .where(ProductStockShard.product_id == Product.id).correlate_except(ProductStockShard).scalar_subquery()
+)
+
 # Модель Order (Заказ)
 class Order(BaseModel):
     __tablename__ = 'orders'
     
-    date: Mapped[datetime] = mapped_column(DateTime, default=datetime.now())
+    date: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     status: Mapped[datetime] = mapped_column(Enum(OrderStatus), default=OrderStatus.in_progress, nullable=False)
+    # Номер версии строки для оптимистической блокировки. Увеличивается при каждом изменении
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version, "eager_defaults": True}
+
+    # Индекс для отбора заказов по статусу и периоду даты и индекс для ленты изменений по курсору (updated_at, id)
+    __table_args__ = (Index("ix_orders_status_date", "status", "date"), Index("ix_orders_updated_at_id", "updated_at", "id"))
 
     # Связь с таблицей OrderItem
     items = relationship("OrderItem", back_populates="order")
@@ -51,19 +121,73 @@ class Order(BaseModel):
 class OrderItem(BaseModel):
     __tablename__ = 'order_items'
     
-    order_id: Mapped[int] = mapped_column(Integer, ForeignKey('orders.id'), nullable=False)
-    product_id: Mapped[int] = mapped_column(Integer, ForeignKey('products.id'), nullable=False)
+    order_id: Mapped[int] = mapped_column(Integer, ForeignKey('orders.id'), nullable=False, index=True)
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey('products.id'), nullable=False, index=True)
     quantity: Mapped[int] = mapped_column(Integer, nullable=False)
 
     # Связи с таблицами Order и Product
     order = relationship("Order", back_populates="items")
     product = relationship("Product")
 
+    __mapper_args__ = {"eager_defaults": True}
+
     def __repr__(self):
         return f"<OrderItem(id={self.id}, order_id={self.order_id}, product_id={self.product_id}, quantity={self.quantity}), update_at={self.updated_at}>"
 
-#Обработчик изменения данных в таблице
-@event.listens_for(BaseModel, 'before_update', propagate=True)
-def update_timestamp_before_update(mapper, connection, target):
-    # Автоматически обновляем поле updated_at на текущее время
-    target.updated_at = datetime.now()
\ No newline at end of file
+# Модель DailySales (Сводка продаж по дням)
+# Заполняется из orders, order_items и products функцией refresh_daily_sales и используется отчетами за большие периоды
+class DailySales(Base):
+    __tablename__ = 'daily_sales'
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    status: Mapped[OrderStatus] = mapped_column(Enum(OrderStatus), primary_key=True)
+    product_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False) # Количество проданных единиц товара
+    revenue: Mapped[float] = mapped_column(Float, nullable=False) # Выручка по текущей цене товара
+    source_updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False) # Последнее изменение заказов, учтенных в строке
+
+    def __repr__(self):
+        return f"<DailySales(day={self.day}, status={self.status}, product_id={self.product_id}, quantity={self.quantity})>"
+
+# Модель DailySalesDirtyDay (День сводки для пересчета)
+# Изменения, после которых orders.updated_at не меняется (удаление позиций вместе с товаром, изменение цены товара),
+# отмечают дни затронутых заказов, и refresh_daily_sales пересчитывает эти дни
+class DailySalesDirtyDay(Base):
+    __tablename__ = 'daily_sales_dirty_days'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+
+    def __repr__(self):
+        return f"<DailySalesDirtyDay(id={self.id}, day={self.day})>"
+
+# Модель IdempotencyKey (Ключ идемпотентности)
+# Хранит результат запроса с заголовком Idempotency-Key, чтобы повтор запроса получил тот же ответ без повторного выполнения
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    scope: Mapped[str] = mapped_column(String, primary_key=True) # Метод и путь запроса
+    key: Mapped[str] = mapped_column(String, primary_key=True) # Значение заголовка Idempotency-Key
+    request_hash: Mapped[str] = mapped_column(String, nullable=False) # Хэш тела запроса
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True) # Код ответа. None, пока запрос выполняется
+    response_body: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True) # Тело ответа
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(scope={self.scope}, key={self.key}, status_code={self.status_code})>"
+
+# Модель DeletedRecord (Запись об удалении)
+# Удаленная строка не попадает в выборку по updated_at, поэтому удаление записывается отдельно для ленты изменений
+class DeletedRecord(Base):
+    __tablename__ = 'deleted_records'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    entity: Mapped[str] = mapped_column(String, nullable=False) # Имя таблицы: products или orders
+    record_id: Mapped[int] = mapped_column(Integer, nullable=False) # ID удаленной записи
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow(), server_default=utcnow())
+
+    # Индекс для ленты изменений по курсору (deleted_at, record_id)
+    __table_args__ = (Index("ix_deleted_records_entity_deleted_at", "entity", "deleted_at", "record_id"),)
+
+    def __repr__(self):
+        return f"<DeletedRecord(entity={self.entity}, record_id={self.record_id}, deleted_at={self.deleted_at})>"
@@ -0,0 +1,121 @@
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from datetime import datetime
+from time import monotonic
+from typing import List, Optional
+from app.async_functions_for_BD import create_orders_batch
+from app.models import OrderStatus
+from app.schemas import ProductInOrderRequest
+import asyncio
+import logging
+
+#Прием заказов пачками (group commit).
+#При пиковой нагрузке время создания заказа определяется временем фиксации транзакции.
+#Запросы POST /orders ставятся в очередь внутри процесса, фоновая задача собирает их в пачки
+#и создает все заказы пачки в одной транзакции, поэтому пропускная способность растет с размером пачки.
+
+logger = logging.getLogger("app.order_ingestion")
+
+
+class OrderBatcher:
+    """
+    Очередь заказов с фоновой задачей, которая создает заказы пачками.
+    Пачка отправляется в БД, когда набрано batch_size заказов или с момента первого заказа прошло max_wait секунд.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, batch_size: int, max_wait: float):
+        """
+        :param session_maker: Фабрика асинхронных сессий основной БД.
+        :param batch_size: Максимальное количество заказов в одной транзакции.
+        :param max_wait: Максимальное время ожидания заполнения пачки в секундах.
+        """
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._closed = False
+        self.batches = 0
+        self.orders = 0
+
+    def start(self) -> None:
+        """
+        Запуск фоновой задачи. Вызывается при запуске приложения.
+        """
+        self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, date_order: datetime, status: OrderStatus, products: List[ProductInOrderRequest]) -> tuple[str, int, Optional[int]]:
+        """
+        Постановка заказа в очередь и ожидание результата пачки.
+
+        :param date_order: Дата заказа
+        :param status: Статус заказа
+        :param products: Список товаров для добавления в заказ
+        :return: Результат как у create_new_order: сообщение, код и ID заказа.
+        """
+        if self._closed:
+            return "Error: order ingestion stopped", -1, None
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((date_order, status, products), future))
+        return await future
+
+    async def _collect(self) -> list:
+        """
+        Ожидание первого заказа и добор пачки до batch_size или до истечения max_wait.
+        """
+        batch = [await self._queue.get()]
+        deadline = monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        """
+        Фоновая задача: сбор пачек и создание заказов. Каждый запрос получает результат своего заказа.
+        """
+        while True:
+            batch = await self._collect()
+            try:
+                async with self.session_maker() as session:
+                    results = await create_orders_batch(session, [order for order, _ in batch])
+            except Exception as e:
+                logger.exception("Order batch failed")
+                results = [(f"Error: {e}", -1, None)] * len(batch)
+            self.batches += 1
+            self.orders += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        """
+        Остановка приема заказов. Заказы, уже поставленные в очередь, создаются, после чего фоновая задача останавливается.
+        """
+        self._closed = True
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def status(self) -> dict:
+        """
+        Состояние очереди для служебного эндпоинта.
+        """
+        return {
+            "batch_size": self.batch_size,
+            "max_wait": self.max_wait,
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "orders": self.orders
+        }
@@ -0,0 +1,106 @@
+from sqlalchemy import exc
+from sqlalchemy.pool import Pool, QueuePool
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Optional, Type
+
+#Метрики пула соединений: время ожидания соединения из пула и количество таймаутов.
+
+class PoolMetrics:
+    """
+    Гистограмма времени ожидания соединения из пула.
+    Границы корзин в секундах, значения накопительные, как в Prometheus.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counts = [0] * (len(self.BUCKETS) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._timeouts = 0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Учет одного ожидания соединения.
+
+        :param seconds: Время ожидания в секундах.
+        """
+        with self._lock:
+            index = 0
+            while index < len(self.BUCKETS) and seconds > self.BUCKETS[index]:
+                index += 1
+            self._counts[index] += 1
+            self._sum += seconds
+            self._count += 1
+
+    def observe_timeout(self) -> None:
+        """
+        Учет ожидания, завершившегося таймаутом пула.
+        """
+        with self._lock:
+            self._timeouts += 1
+
+    def snapshot(self) -> Dict:
+        """
+        Текущее состояние гистограммы.
+        """
+        with self._lock:
+            buckets = {}
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, self._counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = cumulative + self._counts[-1]
+            return {
+                "buckets": buckets,
+                "count": self._count,
+                "sum": self._sum,
+                "timeouts": self._timeouts
+            }
+
+
+def timed_pool_class(base: Type[QueuePool], metrics: PoolMetrics) -> Type[QueuePool]:
+    """
+    Создает подкласс пула, который измеряет время получения соединения.
+    Метрики хранятся в атрибуте класса, поэтому сохраняются при пересоздании пула (dispose).
+
+    :param base: Класс пула (QueuePool или AsyncAdaptedQueuePool).
+    :param metrics: Объект для накопления метрик.
+    :return: Класс пула с измерением времени ожидания.
+    """
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            connection = base._do_get(self)
+        except exc.TimeoutError:
+            self.metrics.observe_timeout()
+            raise
+        self.metrics.observe(perf_counter() - started)
+        return connection
+
+    return type(f"Timed{base.__name__}", (base,), {"metrics": metrics, "_do_get": _do_get})
+
+
+def pool_status(pool: Pool) -> Dict:
+    """
+    Состояние пула соединений: выданные, свободные и сверх лимита соединения, а также гистограмма ожидания.
+
+    :param pool: Пул соединений Engine.
+    :return: Словарь с состоянием пула.
+    """
+    metrics: Optional[PoolMetrics] = getattr(pool, "metrics", None)
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout()
+        })
+    if metrics is not None:
+        status["wait_time_seconds"] = metrics.snapshot()
+    return status
@@ -0,0 +1,180 @@
+from collections import deque
+from hmac import compare_digest
+from itertools import count
+from pathlib import Path
+from time import perf_counter, time
+from typing import Deque, Dict, List, Optional
+from app.instrumentation import start_sql_capture, stop_sql_capture
+import asyncio
+import logging
+import orjson
+import random
+
+#Профилирование отдельных HTTP запросов статистическим профилировщиком pyinstrument.
+#Запрос профилируется, если передан заголовок X-Profile-Token с токеном из настроек или по случайной выборке с долей sample_rate.
+#Для профиля сохраняются файл speedscope (открывается на https://www.speedscope.app) и список запросов к БД.
+#Middleware подключается только при заданных настройках, поэтому без них затрат на профилирование нет.
+
+logger = logging.getLogger("app.profiling")
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError: #pyinstrument не установлен, профилирование недоступно
+    Profiler = None
+
+#Заголовок запроса с токеном профилирования и заголовок ответа с ID профиля
+PROFILE_TOKEN_HEADER = b"x-profile-token"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+
+def profiling_enabled(token: Optional[str], sample_rate: float) -> bool:
+    """
+    Проверка, нужно ли подключать ProfilingMiddleware.
+
+    :param token: Токен профилирования из настроек.
+    :param sample_rate: Доля случайно профилируемых запросов из настроек.
+    :return: True, если профилирование включено в настройках и pyinstrument установлен.
+    """
+    if not token and sample_rate <= 0:
+        return False
+    if Profiler is None:
+        logger.warning("Profiling is configured but pyinstrument is not installed")
+        return False
+    return True
+
+
+class ProfileStore:
+    """
+    Хранилище последних профилей в каталоге directory.
+    Хранится не больше max_profiles профилей, файлы самого старого профиля удаляются при добавлении нового.
+    """
+
+    def __init__(self, directory: str, max_profiles: int):
+        """
+        :param directory: Каталог для файлов профилей.
+        :param max_profiles: Максимальное количество хранимых профилей.
+        """
+        self.directory = Path(directory)
+        self.profiles: Deque[Dict] = deque()
+        self.max_profiles = max_profiles
+        self._counter = count(1)
+
+    def new_id(self) -> str:
+        """
+        ID нового профиля: время в миллисекундах и порядковый номер в процессе.
+        """
+        return f"{int(time() * 1000)}-{next(self._counter)}"
+
+    def path(self, profile_id: str, kind: str) -> Optional[Path]:
+        """
+        Путь к файлу профиля.
+
+        :param profile_id: ID профиля.
+        :param kind: speedscope - файл профиля, sql - запросы к БД.
+        :return: Путь или None, если профиля нет в списке.
+        """
+        if not any(profile["id"] == profile_id for profile in self.profiles):
+            return None
+        return self.directory / f"{profile_id}.{kind}.json"
+
+    def save(self, info: Dict, speedscope: str, statements: List[Dict]) -> None:
+        """
+        Запись файлов профиля и добавление его в список.
+        Выполняется в отдельном потоке, чтобы запись на диск не блокировала цикл событий.
+
+        :param info: Описание профиля (id, метод, путь, статус, время).
+        :param speedscope: Профиль в формате speedscope.
+        :param statements: Запросы к БД с временем выполнения.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / f"{info['id']}.speedscope.json").write_text(speedscope)
+        (self.directory / f"{info['id']}.sql.json").write_bytes(orjson.dumps(statements, option=orjson.OPT_INDENT_2))
+        self.profiles.append(info)
+        while len(self.profiles) > self.max_profiles:
+            old = self.profiles.popleft()
+            for kind in ("speedscope", "sql"):
+                (self.directory / f"{old['id']}.{kind}.json").unlink(missing_ok=True)
+
+    def list(self) -> List[Dict]:
+        """
+        Список профилей для служебного эндпоинта, новые первыми.
+        """
+        return list(reversed(self.profiles))
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware, которое профилирует HTTP запрос с заголовком X-Profile-Token
+    или случайный запрос с долей sample_rate и сохраняет профиль в ProfileStore.
+    Одновременно профилируется только один запрос, остальные выполняются без профилирования.
+    ID профиля возвращается в заголовке ответа X-Profile-Id.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str], sample_rate: float, interval: float):
+        """
+        :param store: Хранилище профилей.
+        :param token: Токен для заголовка X-Profile-Token. None отключает профилирование по заголовку.
+        :param sample_rate: Доля случайно профилируемых запросов от 0 до 1.
+        :param interval: Интервал выборки стека профилировщиком в секундах.
+        """
+        self.app = app
+        self.store = store
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._busy = False
+
+    def should_profile(self, scope) -> bool:
+        """
+        Проверка, нужно ли профилировать запрос.
+        """
+        if self._busy:
+            return False
+        if self.token is not None:
+            header = dict(scope["headers"]).get(PROFILE_TOKEN_HEADER)
+            if header is not None and compare_digest(header, self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._busy = True
+        profile_id = self.store.new_id()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile_id.encode())]
+            await send(message)
+
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        statements, token = start_sql_capture()
+        started = perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            elapsed = perf_counter() - started
+            stop_sql_capture(token)
+            self._busy = False
+            info = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(scope.get("route"), "path", "unmatched"),
+                "status": status["code"],
+                "duration_ms": round(elapsed * 1000, 3),
+                "sql_count": len(statements),
+                "sql_time_ms": round(sum(statement["duration_ms"] for statement in statements), 3),
+                "created_at": time()
+            }
+            try:
+                await asyncio.to_thread(self.store.save, info, profiler.output(SpeedscopeRenderer()), statements)
+            except Exception:
+                logger.exception("Failed to save profile %s", profile_id)
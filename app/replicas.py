@@ -0,0 +1,141 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from http.cookies import CookieError, SimpleCookie
+from itertools import count
+from time import time
+from typing import Dict, List, Optional
+import asyncio
+import logging
+
+#Маршрутизация чтения на реплики БД.
+#Эндпоинты чтения получают сессию на одной из исправных реплик (по кругу), запись всегда идет в основную БД.
+#Реплика отстает от основной БД, поэтому после изменения клиент в течение окна read-your-writes читает из основной БД:
+#ответ на изменяющий запрос устанавливает cookie со временем окончания окна.
+
+logger = logging.getLogger("app.replicas")
+
+#Имя cookie со временем (unix), до которого чтение идет из основной БД
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+
+
+class ReplicaRouter:
+    """
+    Выбор реплики для чтения по кругу среди исправных реплик.
+    Исправность проверяется фоновой задачей запросом SELECT 1. Если исправных реплик нет, чтение идет в основную БД.
+    До первой успешной проверки реплика считается неисправной, поэтому запросы не уходят на недоступную реплику.
+    """
+
+    def __init__(self, primary: AsyncEngine, replicas: List[AsyncEngine], check_interval: float, check_timeout: float):
+        """
+        :param primary: AsyncEngine основной БД.
+        :param replicas: AsyncEngine реплик.
+        :param check_interval: Интервал проверки реплик в секундах.
+        :param check_timeout: Время ожидания ответа реплики при проверке в секундах.
+        """
+        self.primary = primary
+        self.replicas = replicas
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.healthy: Dict[int, bool] = {index: False for index in range(len(replicas))}
+        self._counter = count()
+
+    def read_engine(self) -> AsyncEngine:
+        """
+        Выбор Engine для чтения.
+
+        :return: AsyncEngine следующей исправной реплики или основной БД.
+        """
+        healthy = [self.replicas[index] for index, is_healthy in self.healthy.items() if is_healthy]
+        if not healthy:
+            return self.primary
+        return healthy[next(self._counter) % len(healthy)]
+
+    async def check_replica(self, index: int) -> None:
+        """
+        Проверка одной реплики запросом SELECT 1.
+        Время ожидания check_timeout включает подключение, чтобы недоступный хост не задерживал проверку.
+
+        :param index: Номер реплики в списке replicas.
+        """
+        async def ping() -> None:
+            async with self.replicas[index].connect() as connection:
+                await connection.execute(text("SELECT 1"))
+
+        try:
+            await asyncio.wait_for(ping(), self.check_timeout)
+            is_healthy = True
+        except Exception as e:
+            logger.warning("Replica %s is unavailable: %s", self.replicas[index].url.render_as_string(hide_password=True), e)
+            is_healthy = False
+        self.healthy[index] = is_healthy
+
+    async def check_replicas(self) -> None:
+        """
+        Параллельная проверка всех реплик. Вызывается при запуске приложения до приема запросов.
+        """
+        await asyncio.gather(*(self.check_replica(index) for index in range(len(self.replicas))))
+
+    async def run_health_checks(self) -> None:
+        """
+        Фоновая проверка всех реплик каждые check_interval секунд после первой проверки при запуске.
+        """
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_replicas()
+
+    def status(self) -> List[Dict]:
+        """
+        Состояние реплик для служебного эндпоинта.
+        """
+        return [
+            {"url": replica.url.render_as_string(hide_password=True), "healthy": self.healthy[index]}
+            for index, replica in enumerate(self.replicas)
+        ]
+
+    async def dispose(self) -> None:
+        """
+        Закрытие соединений всех реплик.
+        """
+        for replica in self.replicas:
+            await replica.dispose()
+
+
+def reads_from_primary(cookie_header: Optional[str]) -> bool:
+    """
+    Проверка окна read-your-writes по cookie запроса.
+
+    :param cookie_header: Значение заголовка Cookie или None.
+    :return: True, если клиент недавно изменял данные и должен читать из основной БД.
+    """
+    if not cookie_header:
+        return False
+    cookie = SimpleCookie()
+    try:
+        cookie.load(cookie_header)
+        return float(cookie[READ_YOUR_WRITES_COOKIE].value) > time()
+    except (KeyError, ValueError, CookieError):
+        return False
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware, которое после успешного изменяющего запроса (не GET и не HEAD)
+    устанавливает cookie окна read-your-writes на window секунд.
+    """
+
+    def __init__(self, app, window: float):
+        self.app = app
+        self.window = window
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.window <= 0 or scope["method"] in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                value = f"{READ_YOUR_WRITES_COOKIE}={time() + self.window:.3f}; Max-Age={int(self.window) + 1}; Path=/; HttpOnly"
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", value.encode("latin-1"))]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
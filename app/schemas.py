@@ -1,6 +1,10 @@
-from pydantic import BaseModel
-from datetime import datetime
-from app.models import OrderStatus
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field
+from datetime import date, datetime
+from typing import Annotated, Dict, List, Optional
+from app.models import OrderStatus, INT4_MIN, INT4_MAX
+
+#ID записи в пределах колонки Integer
+DbId = Annotated[int, Field(ge=INT4_MIN, le=INT4_MAX)]
 
 #Создание Pydantic моделей для валидации данных при работе запросов
 class ProductResponse(BaseModel):
@@ -10,10 +14,11 @@ class ProductResponse(BaseModel):
         name: str
         description: str
         price: float
-        stock_quantity: int
+        #Для объекта Product берутся общий остаток и версия с учетом частей остатка (total_stock, total_version)
+        stock_quantity: int = Field(validation_alias=AliasChoices("total_stock", "stock_quantity"))
+        version: int = Field(validation_alias=AliasChoices("total_version", "version"))
 
-        class Config:
-            orm_mode = True
+        model_config = ConfigDict(from_attributes=True)
 
 class ProductRequest(BaseModel):
         name: str
@@ -21,8 +26,7 @@ class ProductRequest(BaseModel):
         price: float
         stock_quantity: int
 
-        class Config:
-            orm_mode = True
+        model_config = ConfigDict(from_attributes=True)
 
 class OrderResponse(BaseModel):
         id: int 
@@ -30,23 +34,72 @@ class OrderResponse(BaseModel):
         updated_at: datetime
         date: datetime
         status: OrderStatus
+        version: int
 
-        class Config:
-            orm_mode = True
+        model_config = ConfigDict(from_attributes=True)
 
 class OrderRequest(BaseModel):
         date: datetime
         status: OrderStatus
 
-        class Config:
-            orm_mode = True
+        model_config = ConfigDict(from_attributes=True)
 
 class ProductInOrderRequest(BaseModel):
-        product_id: int
-        quantity: int
+        product_id: DbId
+        quantity: int = Field(gt=0, le=INT4_MAX) # Количество больше нуля, иначе списание увеличило бы остаток
 
-        class Config:
-            orm_mode = True
+        model_config = ConfigDict(from_attributes=True)
 
 class OrderStatusRequest(BaseModel):
-    status: OrderStatus
\ No newline at end of file
+    status: OrderStatus
+
+class OrderFilter(BaseModel):
+    status: Optional[OrderStatus] = None # Статус заказа
+    date_from: Optional[datetime] = None # Начало периода по дате заказа, включительно
+    date_to: Optional[datetime] = None # Конец периода по дате заказа, не включительно
+
+class OrderStatusBulkRequest(BaseModel):
+    status: OrderStatus # Новый статус заказов
+    ids: Optional[List[DbId]] = None # ID заказов
+    filter: Optional[OrderFilter] = None # Условия отбора заказов, если ID не переданы
+
+class OrderStatusBulkResponse(BaseModel):
+    status: OrderStatus
+    results: Dict[int, str] # Результат по каждому ID заказа: "Success" или "The order is not missing"
+
+class ProductBulkResponse(BaseModel):
+    ids: List[int] # ID созданных товаров в порядке входных данных
+
+class ProductsByIdsRequest(BaseModel):
+    ids: List[int] # ID товаров в нужном порядке
+
+class ProductsByIdsResponse(BaseModel):
+    items: List[ProductResponse] # Найденные товары в порядке запроса
+    missing: List[int] # ID, для которых товар не найден
+
+class OrderItemResponse(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    line_total: float # Стоимость позиции: количество * цена товара
+    product: ProductResponse
+
+class OrderDetailResponse(OrderResponse):
+    items: List[OrderItemResponse]
+    total: float # Стоимость заказа: сумма стоимостей позиций
+
+class TopProductResponse(BaseModel):
+    product_id: int
+    name: str
+    quantity: int # Количество проданных единиц
+    revenue: float # Выручка по текущей цене товара
+
+    model_config = ConfigDict(from_attributes=True)
+
+class RevenueResponse(BaseModel):
+    day: date
+    status: OrderStatus
+    quantity: int # Количество проданных единиц
+    revenue: float # Выручка по текущей цене товара
+
+    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+Нагрузочный замер эндпоинтов приложения.
+
+Скрипт заполняет локальную БД набором данных (N товаров, M заказов по K позиций),
+отправляет запросы к каждому эндпоинту с фиксированной параллельностью и сохраняет
+RPS и задержки p50/p95/p99 в JSON файл.
+
+Приложение запускается в том же процессе через httpx.ASGITransport, поэтому замер не зависит от сети.
+Режимы приложения переключаются переменными окружения, например --env PRODUCT_CACHE_SIZE=0 отключает кэш товаров.
+
+Пример запуска из корня проекта:
+    python bench/load_benchmark.py --products 10000 --orders 2000 --items 3 --concurrency 32 --output bench_result.json
+Сравнение с предыдущим результатом:
+    python bench/load_benchmark.py --baseline bench_result.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный замер эндпоинтов приложения")
+    parser.add_argument("--database-url", default=None, help="Строка подключения к БД. По умолчанию временная БД SQLite")
+    parser.add_argument("--products", type=int, default=1000, help="Количество товаров в наборе данных")
+    parser.add_argument("--orders", type=int, default=500, help="Количество заказов в наборе данных")
+    parser.add_argument("--items", type=int, default=3, help="Количество позиций в каждом заказе")
+    parser.add_argument("--concurrency", type=int, default=16, help="Количество одновременных запросов")
+    parser.add_argument("--requests", type=int, default=500, help="Количество замеряемых запросов на эндпоинт")
+    parser.add_argument("--warmup", type=int, default=50, help="Количество запросов прогрева на эндпоинт")
+    parser.add_argument("--only", action="append", default=[], help="Замерить только указанные сценарии")
+    parser.add_argument("--env", action="append", default=[], help="Переменная окружения приложения KEY=VALUE")
+    parser.add_argument("--seed", type=int, default=42, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--output", default="bench_result.json", help="Файл для сохранения результатов")
+    parser.add_argument("--baseline", default=None, help="Файл предыдущего результата для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Допустимый рост p95 относительно baseline")
+    return parser.parse_args()
+
+
+def seed_database(engine, products: int, orders: int, items: int, rng: random.Random) -> Dict[str, List[int]]:
+    """
+    Заполнение БД набором данных пачками.
+    Товары создаются с большим остатком, чтобы сценарии создания заказов не упирались в склад.
+
+    :return: Словарь с ID созданных товаров и заказов.
+    """
+    from sqlalchemy import insert
+    from app.models import Product, Order, OrderItem, OrderStatus
+
+    now = datetime.now()
+    statuses = list(OrderStatus)
+    def insert_rows(connection, model, rows: List[Dict[str, Any]]) -> List[int]:
+        if not rows:
+            return []
+        return list(connection.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows).scalars())
+
+    with engine.begin() as connection:
+        product_ids = insert_rows(connection, Product, [
+            {"created_at": now, "updated_at": now, "name": f"Bench product {i}", "description": "bench",
+             "price": round(rng.uniform(1, 1000), 2), "stock_quantity": 10 ** 9}
+            for i in range(products)
+        ])
+        order_ids = insert_rows(connection, Order, [
+            {"created_at": now, "updated_at": now, "date": now - timedelta(minutes=rng.randrange(60 * 24 * 30)),
+             "status": rng.choice(statuses)}
+            for _ in range(orders)
+        ])
+        order_items = [
+            {"created_at": now, "updated_at": now, "order_id": order_id,
+             "product_id": rng.choice(product_ids), "quantity": rng.randint(1, 5)}
+            for order_id in order_ids
+            for _ in range(items)
+        ]
+        insert_rows(connection, OrderItem, order_items)
+    return {"products": product_ids, "orders": order_ids}
+
+
+def build_scenarios(data: Dict[str, List[int]], rng: random.Random) -> Dict[str, Callable[[], Dict[str, Any]]]:
+    """
+    Сценарии замера. Каждый сценарий возвращает параметры одного запроса для httpx.
+    Для DELETE используются отдельно созданные товары, чтобы не менять основной набор данных.
+    """
+    product_ids = data["products"]
+    order_ids = data["orders"]
+    disposable_ids = data["disposable"]
+
+    def new_product() -> Dict[str, Any]:
+        return {"name": "Bench new", "description": "bench", "price": 10.0, "stock_quantity": 100}
+
+    def new_order() -> Dict[str, Any]:
+        return {
+            "order": {"date": datetime.now().isoformat(), "status": "в процессе"},
+            "products": [{"product_id": product_id, "quantity": 1} for product_id in rng.sample(product_ids, min(3, len(product_ids)))]
+        }
+
+    return {
+        "GET /products": lambda: {"method": "GET", "url": "/products"},
+        "GET /products?limit=100": lambda: {"method": "GET", "url": "/products", "params": {"limit": 100, "after": rng.choice(product_ids)}},
+        "GET /products?format=ndjson": lambda: {"method": "GET", "url": "/products", "params": {"format": "ndjson"}},
+        "GET /products?ids": lambda: {"method": "GET", "url": "/products",
+                                      "params": {"ids": ",".join(str(product_id) for product_id in rng.sample(product_ids, min(50, len(product_ids))))}},
+        "GET /products/{id}": lambda: {"method": "GET", "url": f"/products/{rng.choice(product_ids)}"},
+        "GET /orders": lambda: {"method": "GET", "url": "/orders"},
+        "GET /orders?limit=100": lambda: {"method": "GET", "url": "/orders", "params": {"limit": 100, "after": rng.choice(order_ids)}},
+        "GET /orders?status&date_from": lambda: {"method": "GET", "url": "/orders", "params": {"status": "в процессе", "limit": 100,
+                                                                                             "date_from": (datetime.now() - timedelta(days=1)).isoformat()}},
+        "GET /orders/{id}": lambda: {"method": "GET", "url": f"/orders/{rng.choice(order_ids)}"},
+        "GET /orders/{id}?expand=items": lambda: {"method": "GET", "url": f"/orders/{rng.choice(order_ids)}", "params": {"expand": "items"}},
+        "GET /changes/products?since": lambda: {"method": "GET", "url": "/changes/products",
+                                                "params": {"since": (datetime.utcnow() - timedelta(minutes=10)).isoformat(), "limit": 100}},
+        "GET /export/orders?format=csv&gzip": lambda: {"method": "GET", "url": "/export/orders", "params": {"format": "csv", "gzip": "true"}},
+        "GET /analytics/top-products": lambda: {"method": "GET", "url": "/analytics/top-products"},
+        "GET /analytics/revenue": lambda: {"method": "GET", "url": "/analytics/revenue"},
+        "GET /analytics/revenue?source=summary": lambda: {"method": "GET", "url": "/analytics/revenue", "params": {"source": "summary"}},
+        "GET /analytics/low-stock": lambda: {"method": "GET", "url": "/analytics/low-stock", "params": {"threshold": 10 ** 9}},
+        "POST /products": lambda: {"method": "POST", "url": "/products", "json": new_product()},
+        "POST /products/bulk": lambda: {"method": "POST", "url": "/products/bulk", "json": [new_product() for _ in range(100)]},
+        "PUT /products/{id}": lambda: {"method": "PUT", "url": f"/products/{rng.choice(product_ids)}",
+                                       "json": {"name": "Bench updated", "description": "bench", "price": 10.0, "stock_quantity": 10 ** 9}},
+        "DELETE /products/{id}": lambda: {"method": "DELETE", "url": f"/products/{disposable_ids.pop()}"},
+        "POST /orders": lambda: {"method": "POST", "url": "/orders", "json": new_order()},
+        "PATCH /orders/{id}": lambda: {"method": "PATCH", "url": f"/orders/{rng.choice(order_ids)}",
+                                       "json": {"status": rng.choice(["в процессе", "отправлен", "доставлен"])}},
+        "PATCH /orders": lambda: {"method": "PATCH", "url": "/orders",
+                                  "json": {"status": rng.choice(["в процессе", "отправлен", "доставлен"]), "ids": rng.sample(order_ids, min(100, len(order_ids)))}},
+    }
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга.
+    """
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client, make_request: Callable[[], Dict[str, Any]], total: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Выполнение total запросов с фиксированной параллельностью.
+
+    :return: RPS, задержки в миллисекундах и количество ошибок.
+    """
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            request = make_request()
+            started = perf_counter()
+            response = await client.request(**request)
+            await response.aread()
+            latencies.append((perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+    }
+
+
+def compare_with_baseline(results: Dict[str, Any], baseline_path: str, max_regression: float) -> List[str]:
+    """
+    Сравнение p95 с предыдущим результатом.
+
+    :return: Список сценариев, у которых p95 вырос больше допустимого.
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)["results"]
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous and previous["p95_ms"] > 0 and result["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {result['p95_ms']} ms")
+    return regressions
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    from app.get_session_maker import get_engine_db
+    from app.init_db import init_db
+    from app.main import app
+
+    rng = random.Random(args.seed)
+    engine = get_engine_db()
+    init_db(engine)
+    data = seed_database(engine, args.products, args.orders, args.items, rng)
+    #Товары для сценария удаления
+    data["disposable"] = seed_database(engine, args.requests + args.warmup, 0, 0, rng)["products"]
+    engine.dispose()
+
+    scenarios = build_scenarios(data, rng)
+    if args.only:
+        scenarios = {name: scenario for name, scenario in scenarios.items() if name in args.only}
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    #ASGITransport не запускает lifespan, поэтому он выполняется явно: при выходе закрываются пулы соединений
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name, make_request in scenarios.items():
+            if args.warmup:
+                await run_scenario(client, make_request, args.warmup, args.concurrency)
+            results[name] = await run_scenario(client, make_request, args.requests, args.concurrency)
+            print(f"{name:32} {results[name]['rps']:>10} rps  p50 {results[name]['p50_ms']:>9} ms  "
+                  f"p95 {results[name]['p95_ms']:>9} ms  p99 {results[name]['p99_ms']:>9} ms  errors {results[name]['errors']}")
+    return results
+
+
+def main() -> int:
+    args = parse_args()
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    #Настройки приложения читаются при импорте, поэтому окружение задается до импорта app
+    temp_dir = None
+    if args.database_url is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(temp_dir.name, 'bench.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    results = asyncio.run(main_async(args))
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "config": {
+            "database": args.database_url.split("://")[0],
+            "products": args.products,
+            "orders": args.orders,
+            "items": args.items,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "env": args.env,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())